@@ -0,0 +1,238 @@
+"""
+VoltStation - уведомления о свободных слотах
+Обратный пространственный индекс подписок и отправка уведомлений с учётом лимитов Telegram
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramBadRequest
+
+from geo import distance_km
+
+logger = logging.getLogger(__name__)
+
+# Размер ячейки сетки: ~1.1 км по широте и ~1.1 км по долготе на широте Нижневартовска
+CELL_LAT = 0.01
+CELL_LON = 0.02
+KM_PER_DEG_LAT = 111.2
+
+
+def cell_of(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / CELL_LAT), math.floor(lon / CELL_LON)
+
+
+class AlertIndex:
+    """Подписки «сообщи, когда в радиусе X км освободится слот»
+
+    Каждая подписка заносится во все ячейки сетки, которые задевает её круг.
+    Когда на станции появляется свободный слот, кандидаты берутся из одной
+    ячейки станции, а не перебором всех подписок.
+
+    Сроки подписок лежат в куче (expires_at, user_id): истёкшие и самые
+    ранние снимаются с вершины за O(log N). Записи отменённых и заменённых
+    подписок остаются в куче и пропускаются, пока куча не перестроится.
+    Истёкшие подписки чистит фоновая задача (start/stop).
+    """
+
+    def __init__(self, ttl: float, max_radius_km: float, max_subscriptions: int):
+        self.ttl = ttl
+        self.max_radius_km = max_radius_km
+        self.max_subscriptions = max_subscriptions
+        # user_id -> {"chat_id", "lat", "lon", "radius", "cells", "expires_at"}
+        self.subscriptions: Dict[int, Dict] = {}
+        self.cells: Dict[Tuple[int, int], set] = {}
+        self._expiry: List[Tuple[float, int]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def _cells_for(self, lat: float, lon: float, radius_km: float) -> List[Tuple[int, int]]:
+        """Ячейки, пересекающие квадрат вокруг круга подписки"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lat_min, lon_min = cell_of(lat - dlat, lon - dlon)
+        lat_max, lon_max = cell_of(lat + dlat, lon + dlon)
+        return [
+            (i, j)
+            for i in range(lat_min, lat_max + 1)
+            for j in range(lon_min, lon_max + 1)
+        ]
+
+    def subscribe(self, user_id: int, chat_id: int, lat: float, lon: float, radius_km: float) -> Dict:
+        """Подписать пользователя (новая подписка заменяет старую)"""
+        self.unsubscribe(user_id)
+        if len(self.subscriptions) >= self.max_subscriptions:
+            # Вытесняем подписку, которая истекает раньше всех
+            self._pop_earliest()
+
+        radius_km = min(radius_km, self.max_radius_km)
+        cells = self._cells_for(lat, lon, radius_km)
+        subscription = {
+            "chat_id": chat_id,
+            "lat": lat,
+            "lon": lon,
+            "radius": radius_km,
+            "cells": cells,
+            "expires_at": time.time() + self.ttl
+        }
+        self.subscriptions[user_id] = subscription
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(user_id)
+        heapq.heappush(self._expiry, (subscription["expires_at"], user_id))
+        if len(self._expiry) > 2 * len(self.subscriptions) + 64:
+            self._rebuild_expiry()
+        return subscription
+
+    def unsubscribe(self, user_id: int) -> bool:
+        """Отменить подписку пользователя"""
+        subscription = self.subscriptions.pop(user_id, None)
+        if not subscription:
+            return False
+        for cell in subscription["cells"]:
+            users = self.cells.get(cell)
+            if users:
+                users.discard(user_id)
+                if not users:
+                    del self.cells[cell]
+        return True
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Действующая подписка пользователя"""
+        subscription = self.subscriptions.get(user_id)
+        if subscription and subscription["expires_at"] < time.time():
+            self.unsubscribe(user_id)
+            return None
+        return subscription
+
+    def _is_current(self, expires_at: float, user_id: int) -> bool:
+        """Запись кучи относится к действующей подписке, а не к отменённой или заменённой"""
+        subscription = self.subscriptions.get(user_id)
+        return subscription is not None and subscription["expires_at"] == expires_at
+
+    def _pop_earliest(self):
+        while self._expiry:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            if self._is_current(expires_at, user_id):
+                self.unsubscribe(user_id)
+                return
+
+    def _rebuild_expiry(self):
+        """Выбросить из кучи записи отменённых и заменённых подписок"""
+        self._expiry = [(s["expires_at"], u) for u, s in self.subscriptions.items()]
+        heapq.heapify(self._expiry)
+
+    def purge_expired(self) -> int:
+        """Удалить истёкшие подписки; результат - сколько удалено"""
+        now = time.time()
+        purged = 0
+        while self._expiry and self._expiry[0][0] < now:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            if self._is_current(expires_at, user_id):
+                self.unsubscribe(user_id)
+                purged += 1
+        return purged
+
+    def start(self, interval: float = 60):
+        """Запустить периодическую чистку истёкших подписок"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._purge_loop(interval))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _purge_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            purged = self.purge_expired()
+            if purged:
+                logger.info(f"Истекло подписок на уведомления: {purged}")
+
+    def match(self, lat: float, lon: float) -> List[Tuple[int, Dict]]:
+        """Подписчики, в чей радиус попадает точка"""
+        now = time.time()
+        matched = []
+        for user_id in list(self.cells.get(cell_of(lat, lon), ())):
+            subscription = self.subscriptions[user_id]
+            if subscription["expires_at"] < now:
+                self.unsubscribe(user_id)
+                continue
+            if distance_km(lat, lon, subscription["lat"], subscription["lon"]) <= subscription["radius"]:
+                matched.append((user_id, subscription))
+        return matched
+
+
+class AlertSender:
+    """Очередь уведомлений с ограничением скорости отправки
+
+    Telegram допускает около 30 сообщений в секунду на бота, поэтому пачка
+    уведомлений разносится во времени, а не отправляется разом.
+    """
+
+    def __init__(self, send: Callable[..., Awaitable], rate_per_second: float, max_queue: int):
+        self.send = send
+        self.interval = 1.0 / rate_per_second
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.sent = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Поставить уведомление в очередь, не дожидаясь отправки"""
+        try:
+            self.queue.put_nowait((chat_id, text, kwargs))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь уведомлений переполнена, чат {chat_id} пропущен")
+            return False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs = await self.queue.get()
+            started = time.monotonic()
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            finally:
+                self.queue.task_done()
+            # Выдерживаем темп, учитывая время самой отправки
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: Dict):
+        for _ in range(3):
+            try:
+                await self.send(chat_id, text, **kwargs)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control при рассылке, ждём {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен - повтор не поможет
+                logger.info(f"Уведомление в чат {chat_id} не доставлено: {e.message}")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления в чат {chat_id}: {e}")
+                return
@@ -0,0 +1,286 @@
+"""
+VoltStation - журнал событий для аналитики
+События копятся в памяти и пачками пишутся в фоне в SQLite-файлы по дням.
+Офлайн-отчёт о спросе по станциям и часам суток:
+
+    python analytics.py heatmap --days 30 --csv heatmap.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Tuple, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = "analytics"
+FILE_PREFIX = "events-"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts          REAL NOT NULL,
+    event       TEXT NOT NULL,
+    user_id     INTEGER,
+    chat_id     INTEGER,
+    city        TEXT,
+    station_id  INTEGER,
+    lat         REAL,
+    lon         REAL,
+    duration_ms REAL,
+    data        TEXT
+);
+"""
+INSERT = (
+    "INSERT INTO events (ts, event, user_id, chat_id, city, station_id, lat, lon, duration_ms, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# События, которые считаются спросом на станцию в отчёте
+DEMAND_EVENTS = ("nearest", "station_view", "map_view", "reserve")
+
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class EventLog:
+    """Журнал событий только на дозапись
+
+    emit() лишь добавляет кортеж в буфер и не ждёт ни диска, ни потока записи.
+    Фоновая задача сбрасывает буфер раз в flush_interval секунд или сразу, как
+    накопится batch_size событий; запись идёт в выделенном потоке одной
+    транзакцией на пачку. Каждые сутки (UTC) - новый файл, файлы старше
+    retention_days удаляются.
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIR, batch_size: int = 500,
+                 flush_interval: float = 5.0, max_pending: int = 50000,
+                 retention_days: int = 180):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retention_days = retention_days
+        self.written = 0
+        self.dropped = 0
+        self._pending: List[Tuple] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_day: Optional[str] = None
+
+    def emit(self, event: str, user_id: Optional[int] = None, chat_id: Optional[int] = None,
+             city: Optional[str] = None, station_id: Optional[int] = None,
+             lat: Optional[float] = None, lon: Optional[float] = None,
+             duration_ms: Optional[float] = None, **data):
+        """Записать событие; не блокирует, при переполнении буфера событие теряется"""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((
+            time.time(), event, user_id, chat_id, city, station_id, lat, lon,
+            None if duration_ms is None else round(duration_ms, 1),
+            json.dumps(data, ensure_ascii=False, default=str) if data else None
+        ))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую задачу и дописать всё, что осталось в буфере"""
+        if self._task:
+            # Не отменяем задачу: идущая запись пачки должна завершиться
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_sync)
+        self._executor.shutdown(wait=True)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_sync, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Не удалось записать {len(batch)} событий аналитики: {e}")
+
+    # ---------- работа с файлами (только в потоке executor) ----------
+
+    def _db_for(self, day: str) -> sqlite3.Connection:
+        if self._conn_day != day:
+            self._close_sync()
+            path = os.path.join(self.directory, f"{FILE_PREFIX}{day}.sqlite3")
+            self._conn = sqlite3.connect(path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn_day = day
+            self._purge_old_sync()
+        return self._conn
+
+    def _write_sync(self, batch: List[Tuple]):
+        # Пачка на стыке суток делится между двумя файлами
+        by_day: Dict[str, List[Tuple]] = {}
+        for row in batch:
+            by_day.setdefault(day_of(row[0]), []).append(row)
+        for day, rows in sorted(by_day.items()):
+            db = self._db_for(day)
+            db.execute("BEGIN")
+            try:
+                db.executemany(INSERT, rows)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def _purge_old_sync(self):
+        cutoff = day_of(time.time() - self.retention_days * 86400)
+        for path in event_files(self.directory):
+            if os.path.basename(path)[len(FILE_PREFIX):len(FILE_PREFIX) + 10] < cutoff:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                logger.info(f"Удалён старый журнал событий: {path}")
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._conn_day = None
+
+
+class HandlerEventsMiddleware(BaseMiddleware):
+    """Событие на каждый вызов обработчика: какой обработчик, для кого и сколько длился"""
+
+    def __init__(self, log: EventLog):
+        self.log = log
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            user = data.get("event_from_user")
+            chat = data.get("event_chat")
+            handler_object = data.get("handler")
+            self.log.emit(
+                "handler",
+                user_id=user.id if user else None,
+                chat_id=chat.id if chat else None,
+                duration_ms=(time.perf_counter() - started) * 1000,
+                handler=handler_object.callback.__name__ if handler_object else type(event).__name__,
+                status=status
+            )
+
+
+# ==================== ОФЛАЙН-ОТЧЁТЫ ====================
+
+def event_files(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, f"{FILE_PREFIX}*.sqlite3")))
+
+
+def demand_heatmap(directory: str, days: int, utc_offset: float) -> Dict[int, List[int]]:
+    """Спрос по станциям и часам суток: station_id -> 24 счётчика (местное время)"""
+    since = time.time() - days * 86400
+    offset = int(utc_offset * 3600)
+    heatmap: Dict[int, List[int]] = {}
+    placeholders = ",".join("?" * len(DEMAND_EVENTS))
+    for path in event_files(directory):
+        if os.path.basename(path)[len(FILE_PREFIX):len(FILE_PREFIX) + 10] < day_of(since):
+            continue
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = db.execute(
+                f"SELECT station_id, CAST(((CAST(ts AS INTEGER) + ?) % 86400) / 3600 AS INTEGER), COUNT(*) "
+                f"FROM events WHERE station_id IS NOT NULL AND ts >= ? AND event IN ({placeholders}) "
+                f"GROUP BY 1, 2",
+                (offset, since, *DEMAND_EVENTS)
+            ).fetchall()
+        finally:
+            db.close()
+        for station_id, hour, count in rows:
+            heatmap.setdefault(station_id, [0] * 24)[hour] += count
+    return heatmap
+
+
+def format_heatmap(heatmap: Dict[int, List[int]]) -> str:
+    """Текстовая тепловая карта: строка - станция, столбец - час"""
+    shades = " ░▒▓█"
+    peak = max((max(hours) for hours in heatmap.values()), default=0)
+    lines = ["станция  " + "".join(f"{h:<2}" for h in range(0, 24, 2)) + "  всего"]
+    for station_id in sorted(heatmap):
+        hours = heatmap[station_id]
+        cells = "".join(
+            shades[min(len(shades) - 1, -(-count * (len(shades) - 1) // peak))] if peak else " "
+            for count in hours
+        )
+        lines.append(f"{station_id:>7}  {cells}  {sum(hours)}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Отчёты по журналу событий VoltStation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    heatmap_parser = commands.add_parser("heatmap", help="спрос по станциям и часам суток")
+    heatmap_parser.add_argument("--dir", default=os.getenv("ANALYTICS_DIR", DEFAULT_DIR))
+    heatmap_parser.add_argument("--days", type=int, default=30, help="за сколько последних дней")
+    heatmap_parser.add_argument("--utc-offset", type=float, default=5, help="часовой пояс, часы от UTC")
+    heatmap_parser.add_argument("--csv", help="сохранить таблицу в CSV")
+    args = parser.parse_args(argv)
+
+    heatmap = demand_heatmap(args.dir, args.days, args.utc_offset)
+    if not heatmap:
+        print("Событий спроса не найдено")
+        return
+    print(format_heatmap(heatmap))
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["station_id"] + [f"{h:02d}" for h in range(24)] + ["total"])
+            for station_id in sorted(heatmap):
+                writer.writerow([station_id] + heatmap[station_id] + [sum(heatmap[station_id])])
+        print(f"CSV: {args.csv}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+VoltStation - каталог станций по городам
+Каждый город - отдельный раздел со своими станциями, индексом, промптом и ценами;
+разделы загружаются при первом обращении
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple, Callable
+
+from geo import distance_km
+from geocoder import normalize, STREET_KINDS
+from storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CITIES_DIR = os.path.join(DATA_DIR, "cities")
+DEFAULT_REGISTRY_PATH = os.path.join(DATA_DIR, "cities.json")
+DEFAULT_PROMPT_PATH = os.path.join(DATA_DIR, "system_prompt.txt")
+SEARCH_CACHE_SIZE = 1024
+# Поля станции, которые видит сайт: API бота и встроенный список карты
+PUBLIC_STATION_FIELDS = (
+    "id", "name", "address", "lat", "lon", "status", "slots", "available",
+    "price_scooter", "price_bike", "rating", "features", "opens"
+)
+
+
+def search_tokens(text: str) -> List[str]:
+    """Слова для поиска без «ул.», «пр.» и т.п."""
+    return [t for t in normalize(text).split() if t not in STREET_KINDS]
+
+
+def public_station(station: Dict) -> Dict:
+    """Станция без служебных полей"""
+    return {k: station[k] for k in PUBLIC_STATION_FIELDS if k in station}
+
+
+def load_registry(path: str = DEFAULT_REGISTRY_PATH, served: Optional[List[str]] = None,
+                  default: Optional[str] = None) -> Dict[str, Dict]:
+    """Реестр городов из JSON; served - оставить только эти города (и город по умолчанию)"""
+    with open(path, encoding="utf-8") as f:
+        registry = json.load(f)
+    if served:
+        registry = {key: meta for key, meta in registry.items() if key in served or key == default}
+    return registry
+
+
+def load_prompt_template(path: str = DEFAULT_PROMPT_PATH) -> str:
+    """Шаблон системного промпта; город и цены подставляет раздел каталога"""
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
+
+
+class City:
+    """Раздел каталога одного города
+
+    Хранит станции города, префиксный индекс для поиска, системный промпт с
+    ценами города и кэш готовых текстов. Кэш текстов живёт до следующей смены
+    версии данных города.
+    """
+
+    def __init__(self, key: str, meta: Dict, stations: List[Dict], prompt_template: str):
+        self.key = key
+        self.name = meta["name"]
+        self.name_in = meta.get("name_in", self.name)      # «в Нижневартовске»
+        self.name_of = meta.get("name_of", self.name)      # «районы Нижневартовска»
+        self.center: Tuple[float, float] = tuple(meta["center"])
+        self.radius_km = meta["radius_km"]
+        self.prices: Dict[str, int] = dict(meta["prices"])
+        self.stations = stations
+        for station in stations:
+            station["city"] = key
+            if station["status"] == "active":
+                station.setdefault("price_scooter", self.prices["scooter"])
+                station.setdefault("price_bike", self.prices["bike"])
+
+        self.system_prompt = prompt_template.format(
+            city=self.name, city_in=self.name_in, city_of=self.name_of, **self.prices
+        )
+        # Промпт одинаков для всех запросов города: считаем его размер один раз
+        self.system_prompt_tokens = len(self.system_prompt) // 3 + 1
+        self.system_message = {"role": "system", "content": self.system_prompt}
+
+        self.version = 0
+        self._texts: Dict[str, str] = {}
+        self.search = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search)
+        self.rebuild_index()
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def rebuild_index(self):
+        """Перестроить индекс после изменения списка станций"""
+        index: Dict[str, set] = {}
+        for station in self.stations:
+            for token in search_tokens(f"{station['name']} {station['address']}"):
+                for i in range(1, len(token) + 1):
+                    index.setdefault(token[:i], set()).add(station["id"])
+        self.search_index = index
+        self.stations_by_id = {s["id"]: s for s in self.stations}
+        self.search.cache_clear()
+        self.bump_version()
+
+    def bump_version(self):
+        """Отметить, что данные станций города изменились"""
+        self.version += 1
+        self._texts.clear()
+
+    def render(self, name: str, build: Callable[["City"], str]) -> str:
+        """Готовый текст города; собирается заново только после изменения станций"""
+        text = self._texts.get(name)
+        if text is None:
+            text = self._texts[name] = build(self)
+        return text
+
+    def _search(self, query: str) -> Tuple[int, ...]:
+        """id станций, у которых каждое слово запроса - начало какого-то слова"""
+        tokens = search_tokens(query)
+        if tokens:
+            ids = set.intersection(*(self.search_index.get(t, set()) for t in tokens))
+        else:
+            ids = set(self.stations_by_id)
+        return tuple(sorted(ids, key=lambda i: (self.stations_by_id[i]["status"] != "active", i)))
+
+
+class CityCatalog:
+    """Реестр городов с ленивой загрузкой разделов
+
+    В реестре лежит только описание города: центр, радиус обслуживания, цены и
+    источник станций (список или имя JSON-файла в data/cities). Станции, индекс
+    и промпт появляются в памяти при первом обращении к городу, поэтому воркер
+    держит только те города, пользователей которых он обслуживает.
+    """
+
+    def __init__(self, registry: Dict[str, Dict], default: str, prompt_template: str,
+                 on_load: Optional[Callable[[City], None]] = None,
+                 data_dir: str = DEFAULT_CITIES_DIR):
+        if default not in registry:
+            raise ValueError(f"Город по умолчанию '{default}' отсутствует в реестре")
+        self.registry = registry
+        self.default = default
+        self.prompt_template = prompt_template
+        self.on_load = on_load
+        self.data_dir = data_dir
+        self._loaded: Dict[str, City] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.registry
+
+    def loaded(self) -> List[City]:
+        """Уже загруженные города"""
+        return list(self._loaded.values())
+
+    def get(self, key: Optional[str] = None) -> City:
+        """Раздел города; неизвестный ключ - город по умолчанию"""
+        if key not in self.registry:
+            key = self.default
+        city = self._loaded.get(key)
+        if city is None:
+            city = self._load(key)
+        return city
+
+    def _load(self, key: str) -> City:
+        meta = self.registry[key]
+        stations = meta["stations"]
+        if isinstance(stations, str):
+            with open(os.path.join(self.data_dir, stations), encoding="utf-8") as f:
+                stations = json.load(f)
+
+        city = City(key, meta, stations, self.prompt_template)
+        for other in self._loaded.values():
+            duplicates = city.stations_by_id.keys() & other.stations_by_id.keys()
+            if duplicates:
+                logger.error(f"Города {key} и {other.key}: одинаковые id станций {sorted(duplicates)}")
+        self._loaded[key] = city
+        logger.info(f"✅ Город {city.name}: загружено станций - {len(city)}")
+        if self.on_load:
+            self.on_load(city)
+        return city
+
+    def locate(self, lat: float, lon: float) -> Optional[str]:
+        """Ключ ближайшего города, в радиус которого попадает точка"""
+        best, best_distance = None, math.inf
+        for key, meta in self.registry.items():
+            distance = distance_km(lat, lon, *meta["center"])
+            if distance <= meta["radius_km"] and distance < best_distance:
+                best, best_distance = key, distance
+        return best
+
+    def for_location(self, lat: float, lon: float) -> City:
+        """Раздел города, в котором находится точка (или город по умолчанию)"""
+        return self.get(self.locate(lat, lon))
+
+    def find_station(self, station_id: int) -> Optional[Dict]:
+        """Станция среди уже загруженных городов"""
+        for city in self._loaded.values():
+            station = city.stations_by_id.get(station_id)
+            if station:
+                return station
+        return None
+
+    def station(self, station_id: int) -> Optional[Dict]:
+        """Станция по id; при промахе догружаются остальные города
+
+        Промах бывает после перезапуска, когда нажимают кнопку в старом
+        сообщении о станции города, который ещё не загружен.
+        """
+        station = self.find_station(station_id)
+        if station is None:
+            for key in self.registry:
+                if key not in self._loaded:
+                    station = self.get(key).stations_by_id.get(station_id)
+                    if station:
+                        break
+        return station
+
+
+class UserCities:
+    """Города, выбранные пользователями вручную (/city)
+
+    Выбор хранится в памяти и сохраняется в JSON-файл, поэтому переживает
+    перезапуск бота. Записей не больше max_users: при переполнении забываются
+    самые давние выборы, и такие пользователи снова получают город по
+    геопозиции или город по умолчанию. Сам выбор только помечает данные
+    изменёнными; файл целиком перезаписывается фоновой задачей не чаще раза
+    в интервал, атомарно и в отдельном потоке.
+    """
+
+    def __init__(self, path: str, max_users: int = 100000):
+        self.path = path
+        self.max_users = max_users
+        self._choices: "OrderedDict[int, str]" = OrderedDict()
+        self._save_lock = asyncio.Lock()
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    # JSON хранит ключи строками и сохраняет порядок от старых к новым
+                    for user_id, key in json.load(f).items():
+                        self._choices[int(user_id)] = key
+            except (OSError, ValueError) as e:
+                logger.warning(f"Выбор городов {path} не прочитан, начинаем заново: {e}")
+        self._trim()
+
+    def __len__(self) -> int:
+        return len(self._choices)
+
+    def get(self, user_id: Optional[int]) -> Optional[str]:
+        return self._choices.get(user_id)
+
+    def set(self, user_id: int, key: str):
+        """Запомнить выбор пользователя; файл сохранится при следующей записи"""
+        self._choices.pop(user_id, None)
+        self._choices[user_id] = key
+        self._trim()
+        self._dirty = True
+
+    def _trim(self):
+        while len(self._choices) > self.max_users:
+            self._choices.popitem(last=False)
+
+    async def flush(self):
+        """Сохранить файл, если с прошлой записи что-то изменилось"""
+        async with self._save_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                await asyncio.to_thread(write_json_atomic, self.path, dict(self._choices))
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Выбор городов {self.path} не сохранён: {e}")
+
+    def start(self, interval: float = 5):
+        """Запустить периодическое сохранение"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(interval))
+
+    async def stop(self):
+        """Остановить сохранение и записать последние изменения"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
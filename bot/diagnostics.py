@@ -0,0 +1,180 @@
+"""
+VoltStation - диагностика работающего бота
+Сэмплирующий профайлер, дамп asyncio-задач, tracemalloc и монитор задержек цикла событий
+"""
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def sample_profile(thread_id: int, seconds: float, interval: float = 0.005) -> Dict:
+    """Снять сэмплирующий профиль потока
+
+    Стек потока читается каждые interval секунд; на сам поток это почти не
+    влияет. Вызывать нужно из другого потока (например, через asyncio.to_thread).
+    """
+    stacks: collections.Counter = collections.Counter()
+    own: collections.Counter = collections.Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stack = []
+            while frame is not None:
+                stack.append(_frame_key(frame))
+                frame = frame.f_back
+            stack.reverse()
+            stacks[";".join(stack)] += 1
+            own[stack[-1]] += 1
+            samples += 1
+        time.sleep(interval)
+
+    return {"samples": samples, "stacks": stacks, "own": own}
+
+
+def format_profile(profile: Dict, top: int = 30) -> str:
+    """Топ функций по собственному времени + стеки в формате flamegraph.pl"""
+    samples = max(profile["samples"], 1)
+    lines = [f"# сэмплов: {profile['samples']}", "", "# собственное время"]
+    for name, count in profile["own"].most_common(top):
+        lines.append(f"{count / samples:6.1%}  {name}")
+    lines += ["", "# свёрнутые стеки"]
+    for stack, count in profile["stacks"].most_common():
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines)
+
+
+def dump_tasks() -> str:
+    """Все asyncio-задачи и то, чего каждая из них ждёт"""
+    lines = []
+    for task in sorted(asyncio.all_tasks(), key=lambda t: t.get_name()):
+        coro = task.get_coro()
+        lines.append(f"== {task.get_name()}: {getattr(coro, '__qualname__', coro)}")
+
+        # Цепочка await: корутина -> корутина, которую она ждёт -> ...
+        awaiting = coro
+        depth = 0
+        while awaiting is not None and depth < 50:
+            frame = getattr(awaiting, "cr_frame", None) or getattr(awaiting, "gi_frame", None)
+            if frame is not None:
+                lines.append(f"   {_frame_key(frame)}")
+            awaiting = getattr(awaiting, "cr_await", None) or getattr(awaiting, "gi_yieldfrom", None)
+            depth += 1
+        if awaiting is not None and not asyncio.iscoroutine(awaiting):
+            lines.append(f"   ждёт: {awaiting!r}"[:300])
+    return "\n".join(lines) or "задач нет"
+
+
+class MemoryTracker:
+    """Снимки tracemalloc и разница с предыдущим снимком"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._last: Optional[tracemalloc.Snapshot] = None
+
+    def snapshot_diff(self, top: int = 25) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._last = tracemalloc.take_snapshot()
+            return "tracemalloc запущен; запросите снимок ещё раз, чтобы увидеть разницу"
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"# сейчас: {current / 1024:.0f} КиБ, пик: {peak / 1024:.0f} КиБ"]
+        if self._last is not None:
+            lines.append(f"# рост с прошлого снимка, топ-{top}")
+            for stat in snapshot.compare_to(self._last, "lineno")[:top]:
+                lines.append(str(stat))
+        self._last = snapshot
+        return "\n".join(lines)
+
+    def stop(self) -> str:
+        tracemalloc.stop()
+        self._last = None
+        return "tracemalloc остановлен"
+
+
+class LoopLagMonitor:
+    """Монитор блокировок цикла событий
+
+    Задача в цикле раз в interval обновляет отметку времени. Отдельный поток
+    проверяет её: если отметка не обновлялась дольше threshold, цикл чем-то
+    занят, и в лог пишется текущий стек его потока - то есть стек колбэка,
+    который держит цикл.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self.blocked = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.max_lag = max(self.max_lag, now - expected)
+            self._heartbeat = now
+
+    def _watch(self):
+        reported_for = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            # Одна блокировка - одна запись в лог
+            if stalled > self.threshold and reported_for != heartbeat:
+                reported_for = heartbeat
+                self.blocked += 1
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+                logger.warning(f"⚠️ Цикл событий заблокирован > {stalled * 1000:.0f} мс:\n{stack}")
+
+    def stats(self) -> Dict:
+        return {
+            "threshold_ms": round(self.threshold * 1000),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "blocked": self.blocked
+        }
@@ -0,0 +1,282 @@
+"""
+VoltStation - готовые ответы на частые вопросы
+Ответы генерируются заранее через GigaChat, а в работе подбираются локально
+по близости вопросов в векторном индексе:
+
+    python faq.py build --city nizhnevartovsk
+"""
+
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from typing import Optional, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from cities import CityCatalog, load_registry, load_prompt_template
+from geocoder import normalize
+from gigachat import GigaChatClient, answer_text
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_QUESTIONS_PATH = os.path.join(DATA_DIR, "faq_questions.txt")
+DEFAULT_STORE_PATH = os.path.join(DATA_DIR, "faq.json")
+
+# Слова, которые не отличают один вопрос от другого
+STOP_WORDS = {
+    "а", "и", "в", "во", "на", "ли", "же", "у", "с", "со", "по", "к", "о", "об",
+    "мне", "я", "вы", "вас", "вам", "это", "бы", "ну", "пожалуйста", "подскажите", "скажите"
+}
+FEATURE_SPACE = 1 << 20
+PROBE_FEATURES = 12     # сколько самых весомых признаков запроса смотрим в индексе
+CANDIDATES = 8          # сколько кандидатов досчитываем точно
+BUILD_CONCURRENCY = 3
+
+
+def _feature(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "little") % FEATURE_SPACE
+
+
+def extract_features(text: str) -> Counter:
+    """Признаки текста: слова целиком и их символьные триграммы (устойчивы к опечаткам и окончаниям)"""
+    counts: Counter = Counter()
+    for word in normalize(text).split():
+        if word in STOP_WORDS:
+            continue
+        counts[_feature(f"w:{word}")] += 1
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            counts[_feature(padded[i:i + 3])] += 1
+    return counts
+
+
+def prompt_fingerprint(system_prompt: str) -> str:
+    """Отпечаток промпта: ответы, собранные со старыми ценами, не используются"""
+    return hashlib.blake2b(system_prompt.encode(), digest_size=8).hexdigest()
+
+
+class FaqIndex:
+    """Векторный индекс вопросов одного города
+
+    Вопрос превращается в разреженный TF-IDF вектор хэшированных признаков
+    с единичной нормой. Поиск приближённый: кандидаты набираются по
+    инвертированным спискам нескольких самых весомых признаков запроса, и
+    только для них считается точный косинус.
+    """
+
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        texts: List[Tuple[int, Counter]] = []
+        for entry_id, entry in enumerate(entries):
+            for question in [entry["question"]] + entry.get("variants", []):
+                texts.append((entry_id, extract_features(question)))
+
+        df: Counter = Counter()
+        for _, counts in texts:
+            df.update(counts.keys())
+        total = len(texts)
+        self.idf = {f: math.log((1 + total) / (1 + n)) + 1 for f, n in df.items()}
+        self.default_idf = math.log(1 + total) + 1
+
+        self.doc_entries: List[int] = []
+        self.vectors: List[Dict[int, float]] = []
+        self.postings: Dict[int, List[Tuple[int, float]]] = {}
+        for entry_id, counts in texts:
+            vector = self._weigh(counts)
+            if not vector:
+                continue
+            doc = len(self.vectors)
+            self.doc_entries.append(entry_id)
+            self.vectors.append(vector)
+            for feature, weight in vector.items():
+                self.postings.setdefault(feature, []).append((doc, weight))
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def _weigh(self, counts: Counter) -> Dict[int, float]:
+        vector = {f: (1 + math.log(n)) * self.idf.get(f, self.default_idf) for f, n in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {f: w / norm for f, w in vector.items()} if norm else {}
+
+    def embed(self, text: str) -> Dict[int, float]:
+        return self._weigh(extract_features(text))
+
+    def search(self, text: str) -> Optional[Tuple[float, Dict]]:
+        """Ближайший вопрос: (косинусная близость, запись) или None"""
+        query = self.embed(text)
+        if not query:
+            return None
+
+        partial: Dict[int, float] = {}
+        for feature, weight in heapq.nlargest(PROBE_FEATURES, query.items(), key=lambda kv: kv[1]):
+            for doc, doc_weight in self.postings.get(feature, ()):
+                partial[doc] = partial.get(doc, 0.0) + weight * doc_weight
+        if not partial:
+            return None
+
+        best_score, best_doc = 0.0, None
+        for doc in heapq.nlargest(CANDIDATES, partial, key=partial.get):
+            vector = self.vectors[doc]
+            score = sum(w * vector.get(f, 0.0) for f, w in query.items())
+            if score > best_score:
+                best_score, best_doc = score, doc
+        if best_doc is None:
+            return None
+        return best_score, self.entries[self.doc_entries[best_doc]]
+
+
+class FaqStore:
+    """Готовые ответы по городам; индекс города строится при первом обращении"""
+
+    def __init__(self, entries: List[Dict], min_similarity: float):
+        self.entries = entries
+        self.min_similarity = min_similarity
+        self._indexes: Dict[Tuple[str, str], FaqIndex] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_STORE_PATH, min_similarity: float = 0.75) -> "FaqStore":
+        """Загрузить ответы; без файла хранилище пустое и ничего не находит"""
+        entries = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)["entries"]
+            logger.info(f"✅ Готовые ответы: {len(entries)}")
+        else:
+            logger.warning(f"Готовые ответы не найдены: {path} (соберите: python faq.py build)")
+        return cls(entries, min_similarity)
+
+    def index_for(self, city_key: str, fingerprint: str) -> FaqIndex:
+        key = (city_key, fingerprint)
+        index = self._indexes.get(key)
+        if index is None:
+            entries = [e for e in self.entries if e["city"] == city_key and e["prompt"] == fingerprint]
+            stale = sum(1 for e in self.entries if e["city"] == city_key) - len(entries)
+            if stale:
+                logger.warning(f"Готовые ответы для {city_key}: {stale} устарели после смены промпта")
+            index = self._indexes[key] = FaqIndex(entries)
+        return index
+
+    def answer(self, question: str, city_key: str, system_prompt: str) -> Optional[Tuple[float, str]]:
+        """Готовый ответ, если вопрос достаточно похож на один из собранных"""
+        if not self.entries:
+            return None
+        found = self.index_for(city_key, prompt_fingerprint(system_prompt)).search(question)
+        if found and found[0] >= self.min_similarity:
+            return found[0], found[1]["answer"]
+        return None
+
+
+# ==================== СБОРКА ====================
+
+def read_questions(path: str) -> List[List[str]]:
+    """Вопросы: строка - вопрос и его варианты через « | », # - комментарий"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                questions.append([q.strip() for q in line.split("|") if q.strip()])
+    return questions
+
+
+async def build(questions_path: str, store_path: str, city_keys: List[str]):
+    """Прогнать вопросы через GigaChat и сохранить ответы
+
+    Города и промпт берутся из тех же файлов data/, что и у бота, поэтому
+    отпечаток промпта в ответах совпадёт с тем, что бот посчитает в работе.
+    """
+    registry = load_registry()
+    unknown = [key for key in city_keys if key not in registry]
+    if unknown:
+        raise SystemExit(f"Города {unknown} отсутствуют в data/cities.json")
+    questions = read_questions(questions_path)
+    catalog = CityCatalog(registry, city_keys[0], load_prompt_template())
+    client = GigaChatClient.from_env()
+    token = await client.token()
+    if not token:
+        raise SystemExit("Не удалось получить токен GigaChat (GIGACHAT_CLIENT_ID / GIGACHAT_CLIENT_SECRET)")
+    semaphore = asyncio.Semaphore(BUILD_CONCURRENCY)
+
+    async def ask(city, variants: List[str]) -> Optional[Dict]:
+        messages = [city.system_message, {"role": "user", "content": variants[0]}]
+        try:
+            async with semaphore:
+                result = await client.chat(token, messages)
+            answer = answer_text(result) if result else None
+        except Exception as e:
+            logger.error(f"Ошибка GigaChat: {e}")
+            answer = None
+        if not answer:
+            logger.error(f"Нет ответа на «{variants[0]}» ({city.key})")
+            return None
+        return {
+            "city": city.key,
+            "prompt": prompt_fingerprint(city.system_prompt),
+            "question": variants[0],
+            "variants": variants[1:],
+            "answer": answer
+        }
+
+    entries = []
+    for key in city_keys:
+        city = catalog.get(key)
+        results = await asyncio.gather(*(ask(city, variants) for variants in questions))
+        entries.extend(r for r in results if r)
+
+    # Ответы других городов из прежней сборки сохраняем
+    if os.path.exists(store_path):
+        with open(store_path, encoding="utf-8") as f:
+            entries = [e for e in json.load(f)["entries"] if e["city"] not in city_keys] + entries
+
+    tmp_path = f"{store_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"built_at": int(time.time()), "entries": entries}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, store_path)
+    logger.info(f"✅ Сохранено ответов: {len(entries)} -> {store_path}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Готовые ответы VoltStation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="собрать ответы через GigaChat")
+    build_parser.add_argument("--questions", default=DEFAULT_QUESTIONS_PATH)
+    build_parser.add_argument("--out", default=DEFAULT_STORE_PATH)
+    build_parser.add_argument("--city", action="append", help="город (можно несколько); по умолчанию - DEFAULT_CITY")
+    ask_parser = commands.add_parser("ask", help="проверить, какой ответ найдётся на вопрос")
+    ask_parser.add_argument("question")
+    ask_parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    ask_parser.add_argument("--city", default=os.getenv("DEFAULT_CITY", "nizhnevartovsk"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == "build":
+        load_dotenv()
+        city_keys = args.city or [os.getenv("DEFAULT_CITY", "nizhnevartovsk")]
+        asyncio.run(build(args.questions, args.out, city_keys))
+    else:
+        store = FaqStore.load(args.store)
+        entries = [e for e in store.entries if e["city"] == args.city]
+        started = time.perf_counter()
+        found = FaqIndex(entries).search(args.question) if entries else None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not found:
+            print("Похожих вопросов нет")
+        else:
+            print(f"близость {found[0]:.3f} ({elapsed_ms:.2f} мс с построением индекса)")
+            print(f"вопрос: {found[1]['question']}\n\n{found[1]['answer']}")
+
+
+if __name__ == "__main__":
+    main()
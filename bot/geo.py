@@ -0,0 +1,18 @@
+"""
+VoltStation - геометрия на поверхности Земли
+Общие для бота, каталога городов, уведомлений и маршрутов расчёты расстояний
+"""
+
+import math
+
+EARTH_RADIUS_KM = 6371
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между точками по гаверсинусу (км)"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(dlon / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
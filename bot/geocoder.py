@@ -0,0 +1,246 @@
+"""
+VoltStation - офлайн-геокодер адресов Нижневартовска
+Улицы загружаются из локального CSV в префиксное дерево с нечётким поиском
+"""
+
+import csv
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "streets.csv")
+
+# Слова, обозначающие тип улицы, и «шум» вокруг адреса
+STREET_KINDS = {
+    "ул", "улица", "пр", "пр-т", "пр-кт", "проспект", "б-р", "бульвар",
+    "пер", "переулок", "проезд", "пр-д", "пл", "площадь", "мкр", "микрорайон"
+}
+FILLER_WORDS = {"на", "у", "около", "возле", "рядом", "с", "со", "дом", "д", "г", "город", "нижневартовск"}
+
+# Адрес короткий: длинный текст или много слов - это вопрос, а не адрес,
+# и обходить ради него дерево улиц незачем
+MAX_ADDRESS_LENGTH = 64
+MAX_ADDRESS_TOKENS = 5
+
+HOUSE_RE = re.compile(r"^(\d{1,4})[а-я]?(?:/\d+)?$")
+TOKEN_RE = re.compile(r"[0-9a-zа-я-]+")
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, без пунктуации"""
+    return " ".join(TOKEN_RE.findall(text.lower().replace("ё", "е")))
+
+
+class TrieNode:
+    __slots__ = ("children", "streets")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.streets: List[int] = []
+
+
+class Geocoder:
+    """Геокодер улиц и номеров домов
+
+    Названия улиц лежат в префиксном дереве. Поиск идёт обходом дерева с
+    построчным расчётом расстояния Левенштейна, поэтому опечатки и недописанные
+    названия находятся без перебора всего справочника.
+    """
+
+    def __init__(self):
+        self.root = TrieNode()
+        # street_id -> {"name", "kind", "segments": [(house_from, house_to, lat1, lon1, lat2, lon2)]}
+        self.streets: List[Dict] = []
+        self._by_name: Dict[Tuple[str, str], int] = {}
+        # Кэш по разобранному адресу, а не по исходному тексту сообщения
+        self._lookup = lru_cache(maxsize=4096)(self._lookup_street)
+
+    def __len__(self) -> int:
+        return len(self.streets)
+
+    # ---------- загрузка ----------
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_DATA_PATH) -> "Geocoder":
+        """Загрузить справочник улиц из CSV"""
+        geocoder = cls()
+        if not os.path.exists(path):
+            logger.warning(f"Справочник улиц не найден: {path}")
+            return geocoder
+
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                geocoder.add_segment(
+                    row["street"], row["kind"],
+                    int(row["house_from"]), int(row["house_to"]),
+                    float(row["lat_from"]), float(row["lon_from"]),
+                    float(row["lat_to"]), float(row["lon_to"])
+                )
+        logger.info(f"✅ Геокодер: загружено улиц - {len(geocoder)}")
+        return geocoder
+
+    def add_segment(self, name: str, kind: str, house_from: int, house_to: int,
+                    lat_from: float, lon_from: float, lat_to: float, lon_to: float):
+        """Добавить участок улицы с диапазоном домов"""
+        key = (normalize(name), kind)
+        street_id = self._by_name.get(key)
+        if street_id is None:
+            street_id = len(self.streets)
+            self._by_name[key] = street_id
+            self.streets.append({"name": name, "kind": kind, "segments": []})
+            self._insert(key[0], street_id)
+            # Составные названия ищутся и по последнему слову: «Жукова», «Джалиля»
+            words = key[0].split()
+            if len(words) > 1 and not words[-1].isdigit():
+                self._insert(words[-1], street_id)
+
+        segments = self.streets[street_id]["segments"]
+        segments.append((house_from, house_to, lat_from, lon_from, lat_to, lon_to))
+        segments.sort()
+        self._lookup.cache_clear()
+
+    def _insert(self, word: str, street_id: int):
+        node = self.root
+        for char in word:
+            node = node.children.setdefault(char, TrieNode())
+        if street_id not in node.streets:
+            node.streets.append(street_id)
+
+    # ---------- поиск ----------
+
+    @staticmethod
+    def max_typos(query: str) -> int:
+        """Сколько опечаток допускаем в зависимости от длины названия"""
+        if len(query) <= 3:
+            return 0
+        if len(query) <= 6:
+            return 1
+        return 2
+
+    def search(self, query: str, prefix: bool = True) -> List[Tuple[int, int]]:
+        """Найти улицы по названию с опечатками: [(число правок, street_id)]
+
+        При prefix=True недописанное название («ханты-ман») тоже считается совпадением.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        limit = self.max_typos(query)
+        best: Dict[int, int] = {}
+        first_row = list(range(len(query) + 1))
+
+        def collect(node: TrieNode, cost: int):
+            for street_id in node.streets:
+                if cost < best.get(street_id, limit + 1):
+                    best[street_id] = cost
+            for child in node.children.values():
+                collect(child, cost)
+
+        def walk(node: TrieNode, char: str, prev_row: List[int]):
+            row = [prev_row[0] + 1]
+            for i in range(1, len(query) + 1):
+                row.append(min(
+                    row[i - 1] + 1,
+                    prev_row[i] + 1,
+                    prev_row[i - 1] + (query[i - 1] != char)
+                ))
+
+            if row[-1] <= limit:
+                if prefix:
+                    # Запрос исчерпан - подходит всё поддерево
+                    collect(node, row[-1])
+                else:
+                    for street_id in node.streets:
+                        if row[-1] < best.get(street_id, limit + 1):
+                            best[street_id] = row[-1]
+
+            if min(row) <= limit:
+                for next_char, child in node.children.items():
+                    walk(child, next_char, row)
+
+        # Опечатка в первой букве редка: сначала ищем только в её поддереве,
+        # и лишь при неудаче обходим всё дерево
+        first = self.root.children.get(query[0])
+        if first is not None:
+            walk(first, query[0], first_row)
+        if not best:
+            for char, child in self.root.children.items():
+                if child is not first:
+                    walk(child, char, first_row)
+
+        return sorted((cost, street_id) for street_id, cost in best.items())
+
+    @staticmethod
+    def split_address(text: str) -> Tuple[str, Optional[int], bool]:
+        """Разобрать адрес на название улицы и номер дома
+
+        Третий элемент - был ли явно указан тип улицы («ул.», «пр.» и т.п.).
+        Для текста, который не похож на адрес, название улицы пустое.
+        """
+        if len(text) > MAX_ADDRESS_LENGTH:
+            return "", None, False
+        tokens = normalize(text).split()
+        has_kind = any(t in STREET_KINDS for t in tokens)
+        tokens = [t for t in tokens if t not in STREET_KINDS and t not in FILLER_WORDS]
+        if len(tokens) > MAX_ADDRESS_TOKENS:
+            return "", None, False
+
+        house = None
+        if len(tokens) > 1:
+            match = HOUSE_RE.match(tokens[-1])
+            if match:
+                house = int(match.group(1))
+                tokens = tokens[:-1]
+        return " ".join(tokens), house, has_kind
+
+    def locate(self, street_id: int, house: Optional[int]) -> Tuple[float, float]:
+        """Координаты дома интерполяцией по участку улицы"""
+        segments = self.streets[street_id]["segments"]
+        if house is None:
+            house_from, house_to = segments[0][0], segments[-1][1]
+            house = (house_from + house_to) // 2
+
+        # Ближайший участок, если номер выходит за известные диапазоны
+        segment = min(
+            segments,
+            key=lambda s: 0 if s[0] <= house <= s[1] else min(abs(house - s[0]), abs(house - s[1]))
+        )
+        house_from, house_to, lat1, lon1, lat2, lon2 = segment
+        span = max(house_to - house_from, 1)
+        t = min(max((house - house_from) / span, 0.0), 1.0)
+        return lat1 + (lat2 - lat1) * t, lon1 + (lon2 - lon1) * t
+
+    def geocode(self, text: str) -> Optional[Dict]:
+        """Перевести адрес в координаты
+
+        Возвращает словарь с улицей, домом, координатами и числом исправленных
+        опечаток или None, если адрес не распознан.
+        """
+        street, house, has_kind = self.split_address(text)
+        if not street or len(street) < 3:
+            return None
+        return self._lookup(street, house, has_kind)
+
+    def _lookup_street(self, street: str, house: Optional[int], has_kind: bool) -> Optional[Dict]:
+        """Найти разобранный адрес в справочнике"""
+        # Без номера дома и типа улицы требуем полного названия, иначе любое
+        # короткое слово в вопросе превращалось бы в адрес
+        matches = self.search(street, prefix=house is not None or has_kind)
+        if not matches:
+            return None
+
+        typos, street_id = matches[0]
+        lat, lon = self.locate(street_id, house)
+        info = self.streets[street_id]
+        return {
+            "street": info["name"],
+            "kind": info["kind"],
+            "house": house,
+            "lat": lat,
+            "lon": lon,
+            "typos": typos
+        }
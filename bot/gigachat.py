@@ -0,0 +1,158 @@
+"""
+VoltStation - клиент GigaChat API
+Получение и кэширование токена доступа, запросы к чату
+"""
+
+import base64
+import logging
+import os
+import time
+import uuid
+from typing import Optional, Dict, List
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+DEFAULT_API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+TOKEN_TTL = 25 * 60         # токен живёт 30 минут, обновляем заранее
+REQUEST_TIMEOUT = 30
+
+
+class GigaChatClient:
+    """Клиент GigaChat с кэшированием токена"""
+
+    def __init__(self, client_id: str, client_secret: str,
+                 auth_url: str = DEFAULT_AUTH_URL, api_url: str = DEFAULT_API_URL):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.auth_url = auth_url
+        self.api_url = api_url
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "GigaChatClient":
+        """Клиент с ключами и адресами из переменных окружения"""
+        return cls(
+            os.getenv("GIGACHAT_CLIENT_ID", ""),
+            os.getenv("GIGACHAT_CLIENT_SECRET", ""),
+            # Адреса API можно переопределить, например, на тестовый сервер
+            auth_url=os.getenv("GIGACHAT_AUTH_URL", DEFAULT_AUTH_URL),
+            api_url=os.getenv("GIGACHAT_API_URL", DEFAULT_API_URL)
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.client_id and self.client_secret)
+
+    def _auth_base64(self) -> str:
+        """Basic-авторизация ClientID:ClientSecret при любом формате секрета"""
+        client_secret = self.client_secret
+
+        # Проверяем формат Client Secret
+        # Вариант 1: Client Secret уже в base64 и содержит ClientID:ClientSecret
+        try:
+            decoded = base64.b64decode(client_secret).decode('utf-8')
+            if ':' in decoded:
+                # Это уже ClientID:ClientSecret в текстовом виде
+                logger.info("Client Secret содержит ClientID:ClientSecret, используем декодированное значение")
+                auth_string = decoded
+            else:
+                # Декодировали, но это просто secret, добавляем ClientID
+                logger.info("Декодировали secret, добавляем ClientID")
+                auth_string = f"{self.client_id}:{decoded}"
+        except Exception:
+            # Если не декодируется, значит это обычный secret
+            logger.info("Client Secret не в base64, формируем ClientID:ClientSecret")
+            auth_string = f"{self.client_id}:{client_secret}"
+
+        logger.info(f"Используем auth_string (первые 20 символов): {auth_string[:20]}...")
+        return base64.b64encode(auth_string.encode()).decode()
+
+    async def token(self) -> Optional[str]:
+        """Получить токен GigaChat с кэшированием"""
+        if self._token and time.time() < self._expires_at:
+            return self._token
+
+        if not self.configured:
+            logger.warning("GigaChat ключи не установлены")
+            return None
+
+        try:
+            headers = {
+                "Authorization": f"Basic {self._auth_base64()}",
+                "RqUID": str(uuid.uuid4()),
+                "Content-Type": "application/x-www-form-urlencoded"
+            }
+
+            data = {"scope": "GIGACHAT_API_PERS"}
+
+            logger.info("Отправка запроса на получение токена GigaChat...")
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    self.auth_url,
+                    headers=headers,
+                    data=data,
+                    ssl=False,
+                    timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+                ) as response:
+                    response_text = await response.text()
+                    logger.info(f"GigaChat OAuth ответ: статус {response.status}")
+
+                    if response.status == 200:
+                        result = await response.json()
+                        token = result.get("access_token")
+                        if token:
+                            self._token = token
+                            self._expires_at = time.time() + TOKEN_TTL
+                            logger.info("✅ Токен GigaChat получен успешно")
+                            return token
+                        else:
+                            logger.error(f"Токен не найден в ответе: {result}")
+                    else:
+                        logger.error(f"Ошибка OAuth: {response.status} - {response_text}")
+        except Exception as e:
+            logger.error(f"Ошибка получения токена: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+
+        return None
+
+    async def chat(self, token: str, messages: List[Dict], temperature: float = 0.7,
+                   max_tokens: int = 1500) -> Optional[Dict]:
+        """Запрос к чату: ответ API целиком или None при ошибке HTTP"""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "model": "GigaChat",
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                self.api_url,
+                headers=headers,
+                json=data,
+                ssl=False,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            ) as response:
+                if response.status == 200:
+                    return await response.json()
+                error_text = await response.text()
+                logger.error(f"Ошибка API: {response.status} - {error_text}")
+        return None
+
+
+def answer_text(result: Dict) -> Optional[str]:
+    """Текст первого варианта ответа"""
+    if "choices" in result and len(result["choices"]) > 0:
+        return result["choices"][0]["message"]["content"].strip()
+    logger.error(f"Неожиданный формат: {result}")
+    return None
@@ -6,21 +6,26 @@ VoltStation Telegram Bot - Premium Edition
 import asyncio
 import logging
 import os
-import aiohttp
-import base64
-import uuid
 import time
 import math
+import gzip
+import hashlib
+import hmac
+import json
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter, TelegramNetworkError
 from aiogram.filters import Command, StateFilter
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, 
     InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton,
-    Location, WebAppInfo
+    Location, WebAppInfo, InaccessibleMessage,
+    InlineQuery, InlineQueryResultVenue
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -28,6 +33,24 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from alerts import AlertIndex, AlertSender
+from analytics import EventLog, HandlerEventsMiddleware
+from faq import FaqStore, DEFAULT_STORE_PATH
+from cities import City, CityCatalog, UserCities, load_registry, load_prompt_template, public_station
+from diagnostics import LoopLagMonitor, MemoryTracker, sample_profile, format_profile, dump_tasks
+from geo import distance_km
+from geocoder import Geocoder
+from gigachat import GigaChatClient, answer_text, DEFAULT_AUTH_URL, DEFAULT_API_URL
+from media import FileIdCache, StationMedia, DEFAULT_STATIC_MAP_URL
+from reservations import ReservationEngine, ReservationError
+from routing import RoadRouter, DEFAULT_GRAPH_PATH
+from updates import UpdateGate
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -45,6 +68,22 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 GIGACHAT_CLIENT_ID = os.getenv("GIGACHAT_CLIENT_ID", "")
 GIGACHAT_CLIENT_SECRET = os.getenv("GIGACHAT_CLIENT_SECRET", "")
+# Адреса API можно переопределить, например, на тестовый сервер
+GIGACHAT_AUTH_URL = os.getenv("GIGACHAT_AUTH_URL", DEFAULT_AUTH_URL)
+GIGACHAT_API_URL = os.getenv("GIGACHAT_API_URL", DEFAULT_API_URL)
+FAQ_PATH = os.getenv("FAQ_PATH", DEFAULT_STORE_PATH)
+FAQ_MIN_SIMILARITY = float(os.getenv("FAQ_MIN_SIMILARITY", 0.75))
+RESERVATIONS_DB = os.getenv("RESERVATIONS_DB", "reservations.sqlite3")
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", 250))
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH", DEFAULT_GRAPH_PATH)
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", "media_cache.json")
+USER_CITIES_PATH = os.getenv("USER_CITIES_PATH", "user_cities.json")
+STATIC_MAP_URL = os.getenv("STATIC_MAP_URL", DEFAULT_STATIC_MAP_URL)
+DEFAULT_CITY = os.getenv("DEFAULT_CITY", "nizhnevartovsk")
+# Города, которые обслуживает этот воркер (через запятую); пусто - все
+SERVED_CITIES = [c.strip() for c in os.getenv("SERVED_CITIES", "").split(",") if c.strip()]
 
 if not BOT_TOKEN:
     raise ValueError("❌ BOT_TOKEN не установлен!")
@@ -56,212 +95,276 @@ bot = Bot(
 )
 dp = Dispatcher(storage=MemoryStorage())
 
-# Кэш для токена GigaChat
-gigachat_cache = {"token": None, "expires_at": 0}
+# Повторные нажатия кнопок отбрасываются, обновления одного чата идут по очереди
+CALLBACK_DEBOUNCE = 1.0             # сек, окно для одинаковых нажатий
+CHAT_QUEUE_IDLE_TTL = 10 * 60       # сек, сколько держим замок неактивного чата
+CHAT_QUEUES_MAX = 10000
+update_gate = UpdateGate(
+    debounce=CALLBACK_DEBOUNCE,
+    idle_ttl=CHAT_QUEUE_IDLE_TTL,
+    max_chats=CHAT_QUEUES_MAX
+)
+dp.update.outer_middleware(update_gate)
+
+# Журнал событий для аналитики: пишется пачками в фоне, по файлу на сутки
+event_log = EventLog(ANALYTICS_DIR)
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.middleware(HandlerEventsMiddleware(event_log))
+
+# Офлайн-геокодер улиц Нижневартовска
+geocoder = Geocoder.from_csv()
+
+# Фото и карты станций: каждая картинка загружается в Telegram один раз
+station_media = StationMedia(FileIdCache(MEDIA_CACHE_PATH), map_url=STATIC_MAP_URL)
+
+# Заранее собранные ответы на частые вопросы (python faq.py build)
+faq_store = FaqStore.load(FAQ_PATH, min_similarity=FAQ_MIN_SIMILARITY)
+
+# Дорожный граф грузится в фоне при старте; пока его нет, ранжируем по прямой
+road_router: Optional[RoadRouter] = None
+
+# Диагностика: монитор блокировок цикла событий и снимки памяти
+loop_monitor = LoopLagMonitor(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+memory_tracker = MemoryTracker()
+DEBUG_PROFILE_MAX_SECONDS = 30
+
+# Клиент GigaChat с кэшем токена
+gigachat = GigaChatClient(
+    GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET,
+    auth_url=GIGACHAT_AUTH_URL, api_url=GIGACHAT_API_URL
+)
+
+# Память диалогов
+DIALOG_TTL = 30 * 60             # секунд бездействия, после которых диалог забывается
+DIALOG_MAX_USERS = 5000          # сколько диалогов держим в памяти одновременно
+DIALOG_TOKEN_BUDGET = 900        # предел токенов истории в одном запросе
+DIALOG_SUMMARY_TOKENS = 250      # предел токенов для сжатой части истории
+
+# Последние известные геопозиции пользователей: user_id -> (lat, lon, timestamp)
+USER_LOCATION_TTL = 2 * 60 * 60
+USER_LOCATION_MAX = 10000
+user_locations: "OrderedDict[int, Tuple[float, float, float]]" = OrderedDict()
+
+# Сколько станций подставлять в запрос к ИИ
+PROMPT_STATIONS_LIMIT = 3
+
+# Инлайн-поиск станций
+INLINE_CACHE_TIME = 60          # сколько секунд Telegram может кэшировать ответ
+INLINE_RESULTS_LIMIT = 10
+
+# Уведомления о свободных слотах
+ALERT_TTL = 6 * 60 * 60             # подписка действует 6 часов
+ALERT_RADII_KM = (1, 3)             # варианты радиуса на кнопках
+ALERT_MAX_RADIUS_KM = 5
+ALERT_MAX_SUBSCRIPTIONS = 50000
+ALERT_RATE_PER_SECOND = 25          # ниже лимита Telegram в 30 сообщений/с
+ALERT_QUEUE_SIZE = 10000
+ALERT_PURGE_INTERVAL = 60           # сек, как часто чистим истёкшие подписки
+
+# Публичный API станций для сайта
+STATIONS_API_CACHE_SIZE = 256       # сколько вариантов bbox держим готовыми
+STATIONS_API_MAX_AGE = 30           # сек, Cache-Control для браузеров
+
+# Бронирование слотов
+RESERVATION_HOLD = 15 * 60          # сколько держим слот за пользователем
+
+# Отпечатки последнего содержимого сообщений: (chat_id, message_id) -> hash
+RENDER_CACHE_MAX = 20000
+render_cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+# Карточка станции, открытая из списка: (chat_id, id списка) -> id карточки
+station_cards: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+
+# Подписки на освобождение слотов и очередь рассылки
+alert_index = AlertIndex(
+    ttl=ALERT_TTL,
+    max_radius_km=ALERT_MAX_RADIUS_KM,
+    max_subscriptions=ALERT_MAX_SUBSCRIPTIONS
+)
+alert_sender = AlertSender(
+    bot.send_message,
+    rate_per_second=ALERT_RATE_PER_SECOND,
+    max_queue=ALERT_QUEUE_SIZE
+)
 
 # Статистика
 stats = {
     "users": set(),
     "messages": 0,
     "stations_found": 0,
-    "ai_requests": 0
+    "ai_requests": 0,
+    "ai_prompt_tokens": 0,
+    "ai_latency_ms": 0.0,
+    "inline_queries": 0,
+    "faq_answers": 0
 }
 
-# Данные станций
-STATIONS = [
-    {
-        "id": 1,
-        "name": "Станция №1",
-        "address": "ул. Ленина, 15",
-        "lat": 60.9450,
-        "lon": 76.5750,
-        "status": "active",
-        "slots": 8,
-        "available": 5,
-        "price_scooter": 150,
-        "price_bike": 200,
-        "rating": 4.8,
-        "features": ["Крытая площадка", "Видеонаблюдение", "Освещение"]
-    },
-    {
-        "id": 2,
-        "name": "Станция №2",
-        "address": "пр. Победы, 8",
-        "lat": 60.9300,
-        "lon": 76.5600,
-        "status": "active",
-        "slots": 6,
-        "available": 3,
-        "price_scooter": 150,
-        "price_bike": 200,
-        "rating": 4.9,
-        "features": ["Крытая площадка", "Видеонаблюдение"]
-    },
-    {
-        "id": 3,
-        "name": "Станция №3",
-        "address": "ул. Мира, 25",
-        "lat": 60.9500,
-        "lon": 76.5800,
-        "status": "active",
-        "slots": 10,
-        "available": 7,
-        "price_scooter": 150,
-        "price_bike": 200,
-        "rating": 4.7,
-        "features": ["Крытая площадка", "Видеонаблюдение", "Освещение", "Wi-Fi"]
-    },
-    {
-        "id": 4,
-        "name": "Станция №4",
-        "address": "ул. Ханты-Мансийская, 12",
-        "lat": 60.9200,
-        "lon": 76.5500,
-        "status": "coming_soon",
-        "slots": 8,
-        "available": 0,
-        "opens": "Q2 2026"
-    },
-    {
-        "id": 5,
-        "name": "Станция №5",
-        "address": "пр. Комсомольский, 30",
-        "lat": 60.9550,
-        "lon": 76.5850,
-        "status": "coming_soon",
-        "slots": 6,
-        "available": 0,
-        "opens": "Q2 2026"
-    }
-]
+# Города присутствия (data/cities.json): центр, радиус, цены и файл станций в
+# data/cities; станции города загружаются при первом обращении к нему
+CITIES = load_registry(served=SERVED_CITIES, default=DEFAULT_CITY)
+
+# Шаблон системного промпта (data/system_prompt.txt); город и цены подставляет раздел каталога
+SYSTEM_PROMPT_TEMPLATE = load_prompt_template()
 
-SYSTEM_PROMPT = """Ты - профессиональный AI-ассистент бота VoltStation, сети зарядных станций для электросамокатов и электровелосипедов в Нижневартовске.
 
-Твоя задача - помогать пользователям максимально эффективно и дружелюбно:
+class BotStates(StatesGroup):
+    waiting_location = State()
+    waiting_question = State()
 
-📋 ИНФОРМАЦИЯ О СЕРВИСЕ:
-• Работаем 24/7 без выходных
-• Цены: электросамокаты от 150₽, электровелосипеды от 200₽
-• Абонементы: от 999₽/месяц (неограниченные зарядки)
-• Станции в спальных районах Нижневартовска
-• Сайт: voltstationnv.ru
 
-🎯 ТВОИ ЗАДАЧИ:
-1. Помогать находить ближайшие станции
-2. Объяснять цены и тарифы
-3. Рассказывать о режиме работы (24/7)
-4. Отвечать на вопросы о сервисе
-5. Помогать с оформлением абонементов
-6. Решать проблемы пользователей
+# ==================== ПАМЯТЬ ДИАЛОГА ====================
 
-💡 СТИЛЬ ОБЩЕНИЯ:
-• Дружелюбный и профессиональный
-• Используй эмодзи для наглядности
-• Структурируй ответы списками
-• Предлагай конкретные действия
-• Если не знаешь ответа - направляй к оператору
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (≈3 символа на токен для кириллицы)"""
+    return len(text) // 3 + 1
 
-Будь полезным, вежливым и эффективным помощником!"""
 
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезать текст до заданного числа токенов"""
+    max_chars = max_tokens * 3
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1].rstrip() + "…"
 
-class BotStates(StatesGroup):
-    waiting_location = State()
-    waiting_question = State()
 
+class DialogMemory:
+    """История диалогов пользователей с TTL и бюджетом токенов
 
-# ==================== GIGACHAT API ====================
+    Диалоги хранятся в OrderedDict в порядке последнего обращения, поэтому
+    вытеснение устаревших и лишних диалогов идёт с головы за O(1) на диалог.
+    Старые реплики, не влезающие в бюджет, сжимаются в короткое резюме.
+    """
 
-async def get_gigachat_token() -> Optional[str]:
-    """Получить токен GigaChat с кэшированием"""
-    if gigachat_cache["token"] and time.time() < gigachat_cache["expires_at"]:
-        return gigachat_cache["token"]
-    
-    if not GIGACHAT_CLIENT_ID or not GIGACHAT_CLIENT_SECRET:
-        logger.warning("GigaChat ключи не установлены")
-        return None
-    
-    try:
-        client_secret = GIGACHAT_CLIENT_SECRET
-        
-        # Проверяем формат Client Secret
-        # Вариант 1: Client Secret уже в base64 и содержит ClientID:ClientSecret
-        try:
-            decoded = base64.b64decode(client_secret).decode('utf-8')
-            if ':' in decoded:
-                # Это уже ClientID:ClientSecret в текстовом виде
-                logger.info("Client Secret содержит ClientID:ClientSecret, используем декодированное значение")
-                auth_string = decoded
-                auth_base64 = base64.b64encode(auth_string.encode()).decode()
+    def __init__(self, ttl: float, max_users: int, token_budget: int, summary_tokens: int):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self._dialogs: "OrderedDict[int, Dict]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._dialogs)
+
+    def _evict(self, now: float):
+        """Удалить просроченные диалоги и соблюсти предел по числу пользователей"""
+        while self._dialogs:
+            dialog = next(iter(self._dialogs.values()))
+            if len(self._dialogs) > self.max_users or now - dialog["updated_at"] > self.ttl:
+                self._dialogs.popitem(last=False)
             else:
-                # Декодировали, но это просто secret, добавляем ClientID
-                logger.info("Декодировали secret, добавляем ClientID")
-                auth_string = f"{GIGACHAT_CLIENT_ID}:{decoded}"
-                auth_base64 = base64.b64encode(auth_string.encode()).decode()
-        except Exception as decode_error:
-            # Если не декодируется, значит это обычный secret
-            logger.info("Client Secret не в base64, формируем ClientID:ClientSecret")
-            auth_string = f"{GIGACHAT_CLIENT_ID}:{client_secret}"
-            auth_base64 = base64.b64encode(auth_string.encode()).decode()
+                break
+
+    def get_history(self, user_id: int) -> Tuple[str, List[Dict]]:
+        """Получить резюме и последние реплики пользователя"""
+        self._evict(time.time())
+        dialog = self._dialogs.get(user_id)
+        if not dialog:
+            return "", []
+        turns = [{"role": role, "content": content} for role, content, _ in dialog["turns"]]
+        return dialog["summary"], turns
+
+    def add_turn(self, user_id: int, question: str, answer: str):
+        """Запомнить пару вопрос-ответ и ужать историю до бюджета"""
+        now = time.time()
+        dialog = self._dialogs.pop(user_id, None)
+        if dialog is None:
+            dialog = {"summary": "", "turns": deque(), "tokens": 0, "updated_at": now}
         
-        logger.info(f"Используем auth_string (первые 20 символов): {auth_string[:20]}...")
+        # Одна пара реплик не должна занимать больше бюджета целиком
+        turn_limit = max(self.token_budget // 2, 1)
+        for role, content in (("user", question), ("assistant", answer)):
+            content = clip_to_tokens(content.strip(), turn_limit)
+            tokens = estimate_tokens(content)
+            dialog["turns"].append((role, content, tokens))
+            dialog["tokens"] += tokens
         
-        headers = {
-            "Authorization": f"Basic {auth_base64}",
-            "RqUID": str(uuid.uuid4()),
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
+        dialog["updated_at"] = now
+        self._dialogs[user_id] = dialog
+        self._compact(dialog)
+        self._evict(now)
+
+    def forget(self, user_id: int):
+        """Забыть диалог пользователя"""
+        self._dialogs.pop(user_id, None)
+
+    def _compact(self, dialog: Dict):
+        """Перенести старые реплики в резюме, пока история не влезет в бюджет"""
+        while dialog["tokens"] > self.token_budget and len(dialog["turns"]) > 2:
+            role, content, tokens = dialog["turns"].popleft()
+            dialog["tokens"] -= tokens
+            dialog["summary"] = self._summarize(dialog["summary"], role, content)
+
+    def _summarize(self, summary: str, role: str, content: str) -> str:
+        """Добавить к резюме первое предложение реплики"""
+        sentence = content.split("\n", 1)[0]
+        for sep in (". ", "! ", "? "):
+            sentence = sentence.split(sep, 1)[0]
+        speaker = "Пользователь" if role == "user" else "Бот"
+        summary = f"{summary} {speaker}: {clip_to_tokens(sentence, 40)}".strip()
         
-        data = {"scope": "GIGACHAT_API_PERS"}
-        
-        logger.info("Отправка запроса на получение токена GigaChat...")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://ngw.devices.sberbank.ru:9443/api/v2/oauth",
-                headers=headers,
-                data=data,
-                ssl=False,
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                response_text = await response.text()
-                logger.info(f"GigaChat OAuth ответ: статус {response.status}")
-                
-                if response.status == 200:
-                    result = await response.json()
-                    token = result.get("access_token")
-                    if token:
-                        gigachat_cache["token"] = token
-                        gigachat_cache["expires_at"] = time.time() + (25 * 60)
-                        logger.info("✅ Токен GigaChat получен успешно")
-                        return token
-                    else:
-                        logger.error(f"Токен не найден в ответе: {result}")
-                else:
-                    logger.error(f"Ошибка OAuth: {response.status} - {response_text}")
-    except Exception as e:
-        logger.error(f"Ошибка получения токена: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-    
-    return None
+        # Резюме тоже ограничено: самые старые факты уходят первыми
+        max_chars = self.summary_tokens * 3
+        if len(summary) > max_chars:
+            summary = "…" + summary[-(max_chars - 1):]
+        return summary
+
+
+dialog_memory = DialogMemory(
+    ttl=DIALOG_TTL,
+    max_users=DIALOG_MAX_USERS,
+    token_budget=DIALOG_TOKEN_BUDGET,
+    summary_tokens=DIALOG_SUMMARY_TOKENS
+)
 
 
-async def ask_gigachat(question: str, context: Optional[str] = None) -> str:
-    """Задать вопрос GigaChat с контекстом"""
+# ==================== GIGACHAT API ====================
+
+AI_UNAVAILABLE_TEXT = (
+    "🤖 <b>ИИ временно недоступен</b>\n\n"
+    "Но я могу помочь через команды:\n"
+    "🔍 /find - найти станцию\n"
+    "💰 /prices - узнать цены\n"
+    "⏰ /schedule - режим работы\n"
+    "📞 /operator - связаться с оператором"
+)
+AI_ERROR_TEXT = (
+    "❌ Произошла ошибка при обработке запроса.\n\n"
+    "Попробуйте позже или используйте команды:\n"
+    "🔍 /find - найти станцию\n"
+    "💰 /prices - цены\n"
+    "⏰ /schedule - режим работы"
+)
+# Ответы-заглушки, которые не являются ответом ИИ
+AI_FALLBACK_TEXTS = (AI_UNAVAILABLE_TEXT, AI_ERROR_TEXT)
+
+
+async def ask_gigachat(
+    question: str,
+    context: Optional[str] = None,
+    user_id: Optional[int] = None,
+    city: Optional[City] = None
+) -> str:
+    """Задать вопрос GigaChat с контекстом и историей диалога пользователя"""
     stats["ai_requests"] += 1
     
-    token = await get_gigachat_token()
+    token = await gigachat.token()
     if not token:
-        return (
-            "🤖 <b>ИИ временно недоступен</b>\n\n"
-            "Но я могу помочь через команды:\n"
-            "🔍 /find - найти станцию\n"
-            "💰 /prices - узнать цены\n"
-            "⏰ /schedule - режим работы\n"
-            "📞 /operator - связаться с оператором"
-        )
+        return AI_UNAVAILABLE_TEXT
     
     try:
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if city is None:
+            city = get_user_city(user_id)
+        system_message = city.system_message
+        prompt_tokens = city.system_prompt_tokens
+        history = []
+        if user_id is not None:
+            summary, history = dialog_memory.get_history(user_id)
+            if summary:
+                summary_text = f"\n\nКратко о предыдущем разговоре: {summary}"
+                system_message = {"role": "system", "content": city.system_prompt + summary_text}
+                prompt_tokens += estimate_tokens(summary_text)
+        
+        messages = [system_message]
+        messages.extend(history)
         
         if context:
             messages.append({
@@ -271,76 +374,75 @@ async def ask_gigachat(question: str, context: Optional[str] = None) -> str:
         else:
             messages.append({"role": "user", "content": question})
         
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        prompt_tokens += sum(estimate_tokens(m["content"]) for m in messages[1:])
         
-        data = {
-            "model": "GigaChat",
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1500
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://gigachat.devices.sberbank.ru/api/v1/chat/completions",
-                headers=headers,
-                json=data,
-                ssl=False,
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    if "choices" in result and len(result["choices"]) > 0:
-                        answer = result["choices"][0]["message"]["content"].strip()
-                        return answer
-                    else:
-                        logger.error(f"Неожиданный формат: {result}")
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Ошибка API: {response.status} - {error_text}")
+        started = time.perf_counter()
+        result = await gigachat.chat(token, messages)
+        if result is not None:
+            latency_ms = (time.perf_counter() - started) * 1000
+            # Если API вернул точный расход токенов - используем его
+            prompt_tokens = result.get("usage", {}).get("prompt_tokens", prompt_tokens)
+            stats["ai_prompt_tokens"] += prompt_tokens
+            stats["ai_latency_ms"] += latency_ms
+            event_log.emit(
+                "ai_answer", user_id=user_id, city=city.key,
+                duration_ms=latency_ms, prompt_tokens=prompt_tokens,
+                with_context=bool(context)
+            )
+            logger.info(f"GigaChat: {prompt_tokens} токенов в запросе, {latency_ms:.0f} мс")
+            answer = answer_text(result)
+            if answer:
+                if user_id is not None:
+                    dialog_memory.add_turn(user_id, question, answer)
+                return answer
     except Exception as e:
         logger.error(f"Ошибка GigaChat: {e}")
     
-    return (
-        "❌ Произошла ошибка при обработке запроса.\n\n"
-        "Попробуйте позже или используйте команды:\n"
-        "🔍 /find - найти станцию\n"
-        "💰 /prices - цены\n"
-        "⏰ /schedule - режим работы"
-    )
+    event_log.emit("ai_error", user_id=user_id)
+    
+    return AI_ERROR_TEXT
 
 
 # ==================== УТИЛИТЫ ====================
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Расчёт расстояния между точками (км)"""
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = (math.sin(dlat / 2) ** 2 +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(dlon / 2) ** 2)
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
-
+async def find_nearest_stations(user_lat: float, user_lon: float, limit: int = 3) -> List[Dict]:
+    """Найти ближайшие станции города, в котором находится точка
 
-def find_nearest_stations(user_lat: float, user_lon: float, limit: int = 3) -> List[Dict]:
-    """Найти ближайшие станции"""
-    active_stations = [s for s in STATIONS if s["status"] == "active"]
+    Порядок - по времени в пути, если загружен дорожный граф, иначе по прямой.
+    Станции возвращаются копиями: расстояние у каждого пользователя своё.
+    """
+    city = catalog.for_location(user_lat, user_lon)
+    active_stations = [
+        {**s, "distance": distance_km(user_lat, user_lon, s["lat"], s["lon"])}
+        for s in city.stations if s["status"] == "active"
+    ]
     
-    for station in active_stations:
-        station["distance"] = calculate_distance(
+    if road_router:
+        # Поиск по графу занимает миллисекунды - не держим на нём цикл событий
+        travel_times = await asyncio.to_thread(
+            road_router.travel_times,
             user_lat, user_lon,
-            station["lat"], station["lon"]
+            {s["id"]: (s["lat"], s["lon"]) for s in active_stations},
+            limit
         )
-    
-    active_stations.sort(key=lambda x: x["distance"])
+        for station in active_stations:
+            seconds = travel_times.get(station["id"])
+            # Недостижимые по дорогам станции уходят в конец списка
+            station["travel_time"] = seconds if seconds is not None else math.inf
+        active_stations.sort(key=lambda x: (x["travel_time"], x["distance"]))
+    else:
+        active_stations.sort(key=lambda x: x["distance"])
     return active_stations[:limit]
 
 
+def format_travel_time(station: Dict) -> str:
+    """'~7 мин' для станции с посчитанным временем в пути"""
+    seconds = station.get("travel_time", math.inf)
+    if seconds == math.inf:
+        return ""
+    return f"~{max(1, round(seconds / 60))} мин"
+
+
 def format_station_info(station: Dict, include_distance: bool = False) -> str:
     """Форматировать информацию о станции"""
     if station["status"] == "coming_soon":
@@ -361,13 +463,15 @@ def format_station_info(station: Dict, include_distance: bool = False) -> str:
     
     if include_distance and "distance" in station:
         text += f"📏 <b>Расстояние:</b> {station['distance']:.2f} км\n"
+        if format_travel_time(station):
+            text += f"🛴 <b>В пути:</b> {format_travel_time(station)}\n"
     
     text += (
         f"⭐ <b>Рейтинг:</b> {station.get('rating', 'N/A')}\n"
         f"🔌 <b>Доступно:</b> {station.get('available', 0)}/{station['slots']} слотов\n\n"
         f"💰 <b>Цены:</b>\n"
-        f"  🛴 Самокаты: {station.get('price_scooter', 150)}₽\n"
-        f"  🚲 Велосипеды: {station.get('price_bike', 200)}₽\n\n"
+        f"  🛴 Самокаты: {station['price_scooter']}₽\n"
+        f"  🚲 Велосипеды: {station['price_bike']}₽\n\n"
     )
     
     if features_text:
@@ -378,6 +482,190 @@ def format_station_info(station: Dict, include_distance: bool = False) -> str:
     return text
 
 
+# ==================== КОНТЕКСТ ДЛЯ ИИ ====================
+
+STATION_KEYWORDS = ("станци", "свобод", "рядом", "ближайш", "заряд", "слот", "адрес")
+# Вопросы, на которые готовый ответ не заменит живых данных: о свободных местах -
+# всегда, о слотах и ближайших станциях - когда известна геопозиция пользователя
+AVAILABILITY_KEYWORDS = ("свобод",)
+NEARBY_KEYWORDS = ("слот", "рядом", "ближайш")
+
+
+def remember_location(user_id: int, lat: float, lon: float):
+    """Запомнить последнюю геопозицию пользователя"""
+    user_locations.pop(user_id, None)
+    user_locations[user_id] = (lat, lon, time.time())
+    while len(user_locations) > USER_LOCATION_MAX:
+        user_locations.popitem(last=False)
+
+
+def get_last_location(user_id: int) -> Optional[Tuple[float, float]]:
+    """Последняя геопозиция пользователя, если она ещё актуальна"""
+    entry = user_locations.get(user_id)
+    if not entry or time.time() - entry[2] > USER_LOCATION_TTL:
+        return None
+    return entry[0], entry[1]
+
+
+def street_stem(address: str) -> str:
+    """Основа названия улицы: 'ул. Ленина, 15' -> 'ленин'"""
+    street = address.split(",")[0].lower()
+    for prefix in ("ул.", "пр.", "пер.", "б-р", "проезд"):
+        street = street.replace(prefix, "")
+    street = street.strip()
+    # Отрезаем окончание, чтобы 'Ленина' находилась и в 'на Ленине'
+    return street[:-1] if len(street) > 4 else street
+
+
+def find_mentioned_stations(text: str, stations: List[Dict]) -> List[Dict]:
+    """Станции, улицы которых упомянуты в тексте"""
+    text = text.lower()
+    return [s for s in stations if street_stem(s["address"]) in text]
+
+
+def format_stations_table(stations: List[Dict], origin: Optional[Tuple[float, float]]) -> str:
+    """Компактная таблица станций для промпта"""
+    lines = ["Станции VoltStation (№|адрес|км|свободно|самокат/велосипед ₽):"]
+    for s in stations:
+        distance = "-"
+        if origin:
+            distance = f"{distance_km(origin[0], origin[1], s['lat'], s['lon']):.1f}"
+        if s["status"] == "active":
+            lines.append(
+                f"{s['id']}|{s['address']}|{distance}|{s.get('available', 0)}/{s['slots']}|"
+                f"{s['price_scooter']}/{s['price_bike']}"
+            )
+        else:
+            lines.append(f"{s['id']}|{s['address']}|{distance}|откроется {s.get('opens', 'скоро')}")
+    return "\n".join(lines)
+
+
+def needs_live_data(text: str, user_id: int, city: City) -> bool:
+    """Ответ зависит от текущих свободных слотов или от того, где пользователь
+
+    Такие вопросы идут в ИИ с контекстом станций, а не в готовые ответы:
+    упомянута конкретная станция, спрашивают о свободных местах или о слотах и
+    ближайших станциях, когда известна геопозиция пользователя.
+    """
+    if find_mentioned_stations(text, city.stations):
+        return True
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in AVAILABILITY_KEYWORDS):
+        return True
+    return (
+        any(keyword in lowered for keyword in NEARBY_KEYWORDS)
+        and get_last_location(user_id) is not None
+    )
+
+
+def build_station_context(text: str, user_id: Optional[int] = None) -> Optional[str]:
+    """Подобрать несколько самых релевантных станций для вопроса пользователя"""
+    city = get_user_city(user_id)
+    mentioned = find_mentioned_stations(text, city.stations)
+    origin = get_last_location(user_id) if user_id is not None else None
+    
+    if not mentioned and not origin:
+        lowered = text.lower()
+        if not any(keyword in lowered for keyword in STATION_KEYWORDS):
+            return None
+    
+    if mentioned and not origin:
+        origin = (mentioned[0]["lat"], mentioned[0]["lon"])
+    
+    if origin:
+        candidates = sorted(
+            city.stations,
+            key=lambda s: (
+                s not in mentioned,
+                s["status"] != "active",
+                distance_km(origin[0], origin[1], s["lat"], s["lon"])
+            )
+        )
+    else:
+        candidates = sorted(
+            city.stations,
+            key=lambda s: (s["status"] != "active", -s.get("available", 0))
+        )
+    
+    return format_stations_table(candidates[:PROMPT_STATIONS_LIMIT], origin)
+
+
+# ==================== ГОРОДА ====================
+
+# Город, выбранный пользователем вручную через /city; сохраняется между перезапусками
+USER_CITIES_MAX = 100000
+USER_CITIES_FLUSH_INTERVAL = 5
+user_cities = UserCities(USER_CITIES_PATH, max_users=USER_CITIES_MAX)
+
+# Фоновые задачи, на которые больше никто не держит ссылку
+background_tasks: set = set()
+
+
+def on_city_loaded(city: City):
+    """Завести слоты станций города, подгруженного уже после запуска бота"""
+    if reservation_engine.is_open:
+        task = asyncio.create_task(reservation_engine.add_stations(city.stations))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+catalog = CityCatalog(CITIES, DEFAULT_CITY, SYSTEM_PROMPT_TEMPLATE, on_load=on_city_loaded)
+
+
+def get_user_city(user_id: Optional[int]) -> City:
+    """Город пользователя: выбранный вручную, иначе по последней геопозиции, иначе по умолчанию"""
+    key = user_cities.get(user_id)
+    if key is None and user_id is not None:
+        location = get_last_location(user_id)
+        if location:
+            key = catalog.locate(*location)
+    return catalog.get(key)
+
+
+# ==================== УВЕДОМЛЕНИЯ ====================
+
+def set_station_availability(station_id: int, available: int):
+    """Обновить число свободных слотов и оповестить подписчиков, если слот освободился"""
+    station = catalog.find_station(station_id)
+    if not station:
+        return
+    
+    was_available = station.get("available", 0)
+    station["available"] = max(0, min(available, station["slots"]))
+    if station["available"] != was_available:
+        catalog.get(station["city"]).bump_version()
+    
+    if station["status"] != "active" or was_available > 0 or station["available"] == 0:
+        return
+    
+    matched = alert_index.match(station["lat"], station["lon"])
+    for user_id, subscription in matched:
+        # Подписка одноразовая: после уведомления снимаем её
+        alert_index.unsubscribe(user_id)
+        distance = distance_km(subscription["lat"], subscription["lon"], station["lat"], station["lon"])
+        alert_sender.enqueue(
+            subscription["chat_id"],
+            f"🔔 <b>Освободился слот!</b>\n\n"
+            f"🟢 {station['name']} - {station['address']}\n"
+            f"📏 {distance:.1f} км от выбранного места\n"
+            f"🔌 Свободно: {station['available']}/{station['slots']}",
+            reply_markup=get_station_keyboard(station_id)
+        )
+    if matched:
+        logger.info(f"Станция {station_id}: слот свободен, уведомлений в очереди - {len(matched)}")
+
+
+# ==================== БРОНИРОВАНИЕ ====================
+
+# Счётчики слотов живут в SQLite; каждое изменение отражается в станциях каталога
+# и при освобождении слота запускает уведомления подписчиков
+reservation_engine = ReservationEngine(
+    RESERVATIONS_DB,
+    hold_seconds=RESERVATION_HOLD,
+    on_change=set_station_availability
+)
+
+
 # ==================== КЛАВИАТУРЫ ====================
 
 def get_main_keyboard() -> InlineKeyboardMarkup:
@@ -420,6 +708,23 @@ def get_station_keyboard(station_id: int) -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="📍 Показать на карте", callback_data=f"map_{station_id}"),
         InlineKeyboardButton(text="💰 Цены", callback_data="prices")
     )
+    
+    station = catalog.station(station_id)
+    if station and station["status"] == "active" and station.get("available", 0) > 0:
+        builder.row(
+            InlineKeyboardButton(text="🔒 Забронировать слот", callback_data=f"reserve_{station_id}")
+        )
+    
+    # Все слоты заняты - предлагаем подписаться на освобождение
+    if station and station["status"] == "active" and station.get("available", 0) == 0:
+        builder.row(*[
+            InlineKeyboardButton(
+                text=f"🔔 Свободно в {radius} км",
+                callback_data=f"alert_{station_id}_{radius}"
+            )
+            for radius in ALERT_RADII_KM
+        ])
+    
     builder.row(
         InlineKeyboardButton(text="📞 Связаться", callback_data="operator"),
         InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
@@ -427,6 +732,319 @@ def get_station_keyboard(station_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# ==================== ОТПРАВКА СООБЩЕНИЙ ====================
+
+# Ошибки редактирования, при которых остаётся только прислать новое сообщение
+EDIT_IMPOSSIBLE_ERRORS = (
+    "message can't be edited",
+    "message to edit not found",
+    "there is no text in the message to edit",
+)
+
+
+def render_fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> int:
+    """Отпечаток содержимого сообщения: текст + клавиатура"""
+    markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup else ""
+    return hash((text, markup_json))
+
+
+def remember_render(chat_id: int, message_id: int, fingerprint: int):
+    """Запомнить, что сейчас показано в сообщении"""
+    key = (chat_id, message_id)
+    render_cache.pop(key, None)
+    render_cache[key] = fingerprint
+    while len(render_cache) > RENDER_CACHE_MAX:
+        render_cache.popitem(last=False)
+
+
+async def edit_or_send(
+    message: "Message | InaccessibleMessage",
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+):
+    """Отредактировать сообщение, если его содержимое действительно меняется
+
+    Повторная отрисовка того же содержимого пропускается без запроса к API.
+    Новое сообщение отправляется, только если старое отредактировать нельзя.
+    """
+    key = (message.chat.id, message.message_id)
+    fingerprint = render_fingerprint(text, reply_markup)
+    if render_cache.get(key) == fingerprint:
+        return
+    
+    if isinstance(message, InaccessibleMessage):
+        # Сообщение слишком старое, бот его больше не видит
+        sent = await bot.send_message(message.chat.id, text, reply_markup=reply_markup)
+        remember_render(sent.chat.id, sent.message_id, fingerprint)
+        return
+    
+    try:
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control при редактировании, ждём {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+            await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        error = e.message.lower()
+        if "message is not modified" in error:
+            pass
+        elif any(reason in error for reason in EDIT_IMPOSSIBLE_ERRORS):
+            logger.info(f"Сообщение нельзя отредактировать ({e.message}), отправляем новое")
+            sent = await message.answer(text, reply_markup=reply_markup)
+            remember_render(sent.chat.id, sent.message_id, fingerprint)
+            return
+        else:
+            raise
+    
+    remember_render(message.chat.id, message.message_id, fingerprint)
+
+
+async def _complete(action):
+    """Дождаться действия: корутины или метода Telegram API
+
+    Методы aiogram (callback.answer(), message.answer() ...) - не корутины, а
+    объекты с __await__, и asyncio.gather их не принимает.
+    """
+    return await action
+
+
+def _discard(action):
+    """Закрыть так и не запущенное действие, чтобы не было предупреждений о забытой корутине"""
+    if asyncio.iscoroutine(action):
+        action.close()
+
+
+class ReplyPlan:
+    """Исходящие действия одного ответа пользователю
+
+    Видимые сообщения отправляются строго по очереди, чтобы сохранить их порядок
+    в чате, а служебные действия (ответ на callback, смена состояния, индикатор
+    печати) выполняются параллельно с ними и не добавляют задержки.
+    """
+
+    def __init__(self):
+        self._messages: List = []
+        self._side: List = []
+
+    def message(self, action) -> "ReplyPlan":
+        """Добавить видимое сообщение (отправляется после предыдущих)"""
+        self._messages.append(action)
+        return self
+
+    def side(self, action) -> "ReplyPlan":
+        """Добавить служебное действие, не зависящее от порядка"""
+        self._side.append(_complete(action))
+        return self
+
+    async def _send_messages(self):
+        for i, action in enumerate(self._messages):
+            try:
+                await action
+            except Exception:
+                # Остальные сообщения уже не отправим - закрываем их корутины
+                for rest in self._messages[i + 1:]:
+                    _discard(rest)
+                raise
+
+    async def run(self):
+        """Выполнить все действия; первая ошибка пробрасывается после завершения остальных"""
+        results = await asyncio.gather(
+            self._send_messages(), *self._side, return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+
+async def send_station_card(message: "Message | InaccessibleMessage", station: Dict):
+    """Карточка станции с фото или картой; если картинку отправить не удалось - текстом
+
+    Карточка редактируется на месте: само сообщение, если оно уже карточка,
+    или карточка, открытая раньше из того же списка станций. Новое сообщение
+    отправляется, только если редактировать нечего или нельзя.
+    """
+    text = format_station_info(station, include_distance="distance" in station)
+    keyboard = get_station_keyboard(station["id"])
+    chat_id = message.chat.id
+    image_key, digest, _ = station_media.image_for(station)
+    fingerprint = render_fingerprint(f"{image_key}:{digest}\n{text}", keyboard)
+    
+    from_card = isinstance(message, Message) and bool(message.photo)
+    target = message.message_id if from_card else station_cards.get((chat_id, message.message_id))
+    if target is not None:
+        if render_cache.get((chat_id, target)) == fingerprint:
+            return
+        try:
+            await station_media.edit_card(bot, chat_id, target, station, text, reply_markup=keyboard)
+            remember_render(chat_id, target, fingerprint)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message.lower():
+                remember_render(chat_id, target, fingerprint)
+                return
+            logger.info(f"Карточку {target} нельзя отредактировать ({e.message}), отправляем новую")
+    
+    try:
+        sent = await station_media.send_card(bot, chat_id, station, text, reply_markup=keyboard)
+    except (TelegramBadRequest, TelegramNetworkError, OSError) as e:
+        # Картинка недоступна: файл не читается, карту не скачать или Telegram её не принял
+        logger.warning(f"Карточка станции {station['id']} без картинки: {e}")
+        await edit_or_send(message, text, reply_markup=keyboard)
+        return
+    
+    remember_render(chat_id, sent.message_id, fingerprint)
+    if not from_card:
+        station_cards.pop((chat_id, message.message_id), None)
+        station_cards[(chat_id, message.message_id)] = sent.message_id
+        while len(station_cards) > RENDER_CACHE_MAX:
+            station_cards.popitem(last=False)
+
+
+def send_station_venue(chat_id: int, station: Dict, title: Optional[str] = None,
+                       address: Optional[str] = None, reply_markup=None):
+    """Точка на карте с названием и адресом станции одним сообщением"""
+    return bot.send_venue(
+        chat_id,
+        latitude=station["lat"],
+        longitude=station["lon"],
+        title=title or f"⚡ {station['name']}",
+        address=address or station["address"],
+        reply_markup=reply_markup
+    )
+
+
+# ==================== ТЕКСТЫ ГОРОДА ====================
+# Тексты зависят от станций и цен города и кэшируются в его разделе до
+# следующего изменения станций
+
+def prices_text(city: City) -> str:
+    """Цены и тарифы города (полная версия для /prices)"""
+    p = city.prices
+    return (
+        "💰 <b>Цены и тарифы VoltStation</b>\n\n"
+        "<b>🛴 Разовые зарядки:</b>\n"
+        f"• Электросамокаты: <b>от {p['scooter']}₽</b>\n"
+        "  └ Быстрая зарядка 1-2 часа\n"
+        "  └ Поддержка всех типов аккумуляторов\n\n"
+        f"• Электровелосипеды: <b>от {p['bike']}₽</b>\n"
+        "  └ Зарядка мощных аккумуляторов\n"
+        "  └ Время зарядки 2-3 часа\n\n"
+        "<b>📅 Абонементы:</b>\n"
+        f"• <b>Базовый: {p['subscription']}₽/месяц</b>\n"
+        "  └ Неограниченное количество зарядок\n"
+        "  └ Приоритетный доступ к станциям\n"
+        "  └ Скидки на дополнительные услуги\n"
+        "  └ Экономия до 50%!\n\n"
+        "<b>💳 Способы оплаты:</b>\n"
+        "💳 Банковская карта\n"
+        "📱 Через Telegram-бот\n"
+        "📲 QR-код на станции\n\n"
+        "<b>💡 Совет:</b> Оформите абонемент и экономьте!"
+    )
+
+
+def prices_short_text(city: City) -> str:
+    """Цены города для кнопки меню"""
+    p = city.prices
+    return (
+        "💰 <b>Цены и тарифы</b>\n\n"
+        "<b>🛴 Разовые зарядки:</b>\n"
+        f"• Электросамокаты: <b>от {p['scooter']}₽</b>\n"
+        f"• Электровелосипеды: <b>от {p['bike']}₽</b>\n\n"
+        "<b>📅 Абонементы:</b>\n"
+        f"• Базовый: <b>{p['subscription']}₽/месяц</b>\n"
+        "  └ Неограниченные зарядки\n"
+        "  └ Приоритетный доступ\n\n"
+        "<b>💳 Оплата:</b> карта, QR, Telegram"
+    )
+
+
+def schedule_text(city: City) -> str:
+    """Режим работы станций города (для /schedule)"""
+    active_count = len([s for s in city.stations if s["status"] == "active"])
+    coming_soon_count = len([s for s in city.stations if s["status"] == "coming_soon"])
+    
+    text = (
+        "⏰ <b>Режим работы станций</b>\n\n"
+        f"<b>🟢 Работающие станции (24/7):</b> {active_count}\n"
+    )
+    
+    for station in city.stations:
+        if station["status"] == "active":
+            text += f"• {station['name']} - {station['address']}\n"
+    
+    if coming_soon_count > 0:
+        text += f"\n<b>🚧 Скоро откроются:</b> {coming_soon_count}\n"
+        for station in city.stations:
+            if station["status"] == "coming_soon":
+                text += f"• {station['name']} - {station['address']} ({station.get('opens', 'Скоро')})\n"
+    
+    text += "\n💡 <b>Все станции работают круглосуточно!</b>"
+    return text
+
+
+def schedule_short_text(city: City) -> str:
+    """Режим работы станций города для кнопки меню"""
+    active = [s for s in city.stations if s["status"] == "active"]
+    coming_soon = [s for s in city.stations if s["status"] == "coming_soon"]
+    
+    text = f"⏰ <b>Режим работы</b>\n\n🟢 Работает: {len(active)} станций\n\n"
+    for s in active:
+        text += f"• {s['name']} - {s['address']}\n"
+    
+    if coming_soon:
+        text += f"\n🚧 Скоро откроются: {len(coming_soon)} станций\n"
+        for s in coming_soon:
+            text += f"• {s['name']} - {s['address']} ({s.get('opens', 'Скоро')})\n"
+    
+    text += "\n💡 Все станции работают <b>24/7</b>!"
+    return text
+
+
+def subscription_text(city: City) -> str:
+    """Абонементы города (для /subscription)"""
+    return (
+        "📋 <b>Абонементы VoltStation</b>\n\n"
+        "<b>🎯 Преимущества абонемента:</b>\n"
+        "✅ Неограниченное количество зарядок\n"
+        "✅ Приоритетный доступ к станциям\n"
+        "✅ Скидки на дополнительные услуги\n"
+        "✅ Экономия до 50% по сравнению с разовыми зарядками\n"
+        "✅ Автоматическое продление\n\n"
+        "<b>💰 Тарифы:</b>\n"
+        f"• Базовый: <b>{city.prices['subscription']}₽/месяц</b>\n"
+        f"• Премиум: <b>{city.prices['premium']}₽/месяц</b> (дополнительные бонусы)\n\n"
+        "<b>📞 Для оформления:</b>\n"
+        "Свяжитесь с нами через кнопку ниже или:\n"
+        "📧 Email: info@voltstationnv.ru\n"
+        "📞 Телефон: +7 (800) 123-45-67"
+    )
+
+
+def subscription_short_text(city: City) -> str:
+    """Абонементы города для кнопки меню"""
+    return (
+        "📋 <b>Абонементы</b>\n\n"
+        "<b>🎯 Преимущества:</b>\n"
+        "✅ Неограниченные зарядки\n"
+        "✅ Приоритетный доступ\n"
+        "✅ Экономия до 50%\n\n"
+        f"<b>💰 От {city.prices['subscription']}₽/месяц</b>\n\n"
+        "Для оформления свяжитесь с нами:"
+    )
+
+
+def get_city_keyboard(current: City) -> InlineKeyboardMarkup:
+    """Выбор города"""
+    builder = InlineKeyboardBuilder()
+    for key, meta in CITIES.items():
+        mark = "✅ " if key == current.key else ""
+        builder.row(InlineKeyboardButton(text=f"{mark}{meta['name']}", callback_data=f"city_{key}"))
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
+    return builder.as_markup()
+
+
 # ==================== ОБРАБОТЧИКИ КОМАНД ====================
 
 @dp.message(Command("start"))
@@ -434,12 +1052,14 @@ async def cmd_start(message: Message):
     """Команда /start"""
     stats["users"].add(message.from_user.id)
     stats["messages"] += 1
+    dialog_memory.forget(message.from_user.id)
     
     user_name = message.from_user.first_name or "друг"
+    city = get_user_city(message.from_user.id)
     
     await message.answer(
         f"⚡ <b>Добро пожаловать в VoltStation, {user_name}!</b>\n\n"
-        f"Я помогу вам найти ближайшую зарядную станцию для вашего электротранспорта в Нижневартовске.\n\n"
+        f"Я помогу вам найти ближайшую зарядную станцию для вашего электротранспорта в {city.name_in}.\n\n"
         f"<b>🚀 Что я умею:</b>\n"
         f"🔍 Найти ближайшую станцию по геолокации\n"
         f"💰 Показать цены и тарифы\n"
@@ -463,6 +1083,8 @@ async def cmd_help(message: Message):
         "/schedule - Режим работы станций\n"
         "/subscription - Информация об абонементах\n"
         "/operator - Связаться с оператором\n"
+        "/alerts - Уведомления о свободных слотах\n"
+        "/city - Выбрать город\n"
         "/help - Показать эту справку\n\n"
         "<b>💡 Как использовать:</b>\n"
         "• Отправьте геолокацию для поиска станции\n"
@@ -481,15 +1103,15 @@ async def cmd_find(message: Message, state: FSMContext):
     """Команда /find"""
     stats["messages"] += 1
     
-    await message.answer(
+    await ReplyPlan().message(message.answer(
         "🔍 <b>Поиск ближайшей станции</b>\n\n"
         "Отправьте вашу геолокацию, и я найду ближайшие зарядные станции.\n\n"
         "<b>💡 Как отправить:</b>\n"
         "1. Нажмите кнопку ниже\n"
-        "2. Или отправьте геолокацию через меню Telegram",
+        "2. Или отправьте геолокацию через меню Telegram\n"
+        "3. Или просто напишите адрес, например: <i>Ленина 15</i>",
         reply_markup=get_location_keyboard()
-    )
-    await state.set_state(BotStates.waiting_location)
+    )).side(state.set_state(BotStates.waiting_location)).run()
 
 
 @dp.message(Command("prices"))
@@ -505,25 +1127,7 @@ async def cmd_prices(message: Message):
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
     
     await message.answer(
-        "💰 <b>Цены и тарифы VoltStation</b>\n\n"
-        "<b>🛴 Разовые зарядки:</b>\n"
-        "• Электросамокаты: <b>от 150₽</b>\n"
-        "  └ Быстрая зарядка 1-2 часа\n"
-        "  └ Поддержка всех типов аккумуляторов\n\n"
-        "• Электровелосипеды: <b>от 200₽</b>\n"
-        "  └ Зарядка мощных аккумуляторов\n"
-        "  └ Время зарядки 2-3 часа\n\n"
-        "<b>📅 Абонементы:</b>\n"
-        "• <b>Базовый: 999₽/месяц</b>\n"
-        "  └ Неограниченное количество зарядок\n"
-        "  └ Приоритетный доступ к станциям\n"
-        "  └ Скидки на дополнительные услуги\n"
-        "  └ Экономия до 50%!\n\n"
-        "<b>💳 Способы оплаты:</b>\n"
-        "💳 Банковская карта\n"
-        "📱 Через Telegram-бот\n"
-        "📲 QR-код на станции\n\n"
-        "<b>💡 Совет:</b> Оформите абонемент и экономьте!",
+        get_user_city(message.from_user.id).render("prices", prices_text),
         reply_markup=builder.as_markup()
     )
 
@@ -533,25 +1137,7 @@ async def cmd_schedule(message: Message):
     """Команда /schedule"""
     stats["messages"] += 1
     
-    active_count = len([s for s in STATIONS if s["status"] == "active"])
-    coming_soon_count = len([s for s in STATIONS if s["status"] == "coming_soon"])
-    
-    text = (
-        "⏰ <b>Режим работы станций</b>\n\n"
-        f"<b>🟢 Работающие станции (24/7):</b> {active_count}\n"
-    )
-    
-    for station in STATIONS:
-        if station["status"] == "active":
-            text += f"• {station['name']} - {station['address']}\n"
-    
-    if coming_soon_count > 0:
-        text += f"\n<b>🚧 Скоро откроются:</b> {coming_soon_count}\n"
-        for station in STATIONS:
-            if station["status"] == "coming_soon":
-                text += f"• {station['name']} - {station['address']} ({station.get('opens', 'Скоро')})\n"
-    
-    text += "\n💡 <b>Все станции работают круглосуточно!</b>"
+    text = get_user_city(message.from_user.id).render("schedule", schedule_text)
     
     await message.answer(text, reply_markup=get_main_keyboard())
 
@@ -569,24 +1155,53 @@ async def cmd_subscription(message: Message):
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
     
     await message.answer(
-        "📋 <b>Абонементы VoltStation</b>\n\n"
-        "<b>🎯 Преимущества абонемента:</b>\n"
-        "✅ Неограниченное количество зарядок\n"
-        "✅ Приоритетный доступ к станциям\n"
-        "✅ Скидки на дополнительные услуги\n"
-        "✅ Экономия до 50% по сравнению с разовыми зарядками\n"
-        "✅ Автоматическое продление\n\n"
-        "<b>💰 Тарифы:</b>\n"
-        "• Базовый: <b>999₽/месяц</b>\n"
-        "• Премиум: <b>1499₽/месяц</b> (дополнительные бонусы)\n\n"
-        "<b>📞 Для оформления:</b>\n"
-        "Свяжитесь с нами через кнопку ниже или:\n"
-        "📧 Email: info@voltstationnv.ru\n"
-        "📞 Телефон: +7 (800) 123-45-67",
+        get_user_city(message.from_user.id).render("subscription", subscription_text),
         reply_markup=builder.as_markup()
     )
 
 
+@dp.message(Command("alerts"))
+async def cmd_alerts(message: Message):
+    """Команда /alerts"""
+    stats["messages"] += 1
+    
+    subscription = alert_index.get(message.from_user.id)
+    if not subscription:
+        await message.answer(
+            "🔕 <b>Уведомлений нет</b>\n\n"
+            "Откройте занятую станцию и нажмите 🔔 - я сообщу, "
+            "как только рядом освободится слот.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    minutes_left = max(int((subscription["expires_at"] - time.time()) // 60), 0)
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔕 Отключить", callback_data="alerts_off"))
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
+    
+    await message.answer(
+        "🔔 <b>Уведомление включено</b>\n\n"
+        f"📏 Радиус: {subscription['radius']:g} км\n"
+        f"⏳ Действует ещё: {minutes_left} мин",
+        reply_markup=builder.as_markup()
+    )
+
+
+@dp.message(Command("city"))
+async def cmd_city(message: Message):
+    """Команда /city"""
+    stats["messages"] += 1
+    
+    city = get_user_city(message.from_user.id)
+    await message.answer(
+        f"🏙 <b>Ваш город: {city.name}</b>\n\n"
+        "Станции, цены и ответы ИИ подбираются для выбранного города. "
+        "Если город не выбран, он определяется по геолокации.",
+        reply_markup=get_city_keyboard(city)
+    )
+
+
 @dp.message(Command("operator"))
 async def cmd_operator(message: Message):
     """Команда /operator"""
@@ -618,207 +1233,132 @@ async def cmd_operator(message: Message):
 @dp.callback_query(F.data == "back_to_main")
 async def callback_back(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
-    try:
-        await callback.message.edit_text(
-            "⚡ <b>VoltStation</b>\n\n"
-            "Выберите действие:",
-            reply_markup=get_main_keyboard()
-        )
-    except Exception as e:
-        # Если не удалось отредактировать (например, сообщение было отправлено как новое)
-        logger.warning(f"Не удалось отредактировать сообщение: {e}")
-        await callback.message.answer(
-            "⚡ <b>VoltStation</b>\n\n"
-            "Выберите действие:",
-            reply_markup=get_main_keyboard()
-        )
-    
-    await state.clear()
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        "⚡ <b>VoltStation</b>\n\n"
+        "Выберите действие:",
+        reply_markup=get_main_keyboard()
+    )).side(state.clear()).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "find_station")
 async def callback_find(callback: CallbackQuery, state: FSMContext):
     """Поиск станции"""
-    try:
-        await callback.message.edit_text(
-            "🔍 <b>Поиск ближайшей станции</b>\n\n"
-            "Отправьте вашу геолокацию:",
-            reply_markup=get_location_keyboard()
-        )
-        await state.set_state(BotStates.waiting_location)
-    except Exception as e:
-        logger.error(f"Ошибка в callback_find: {e}")
-        await callback.message.answer(
-            "🔍 <b>Поиск ближайшей станции</b>\n\n"
-            "Отправьте вашу геолокацию:",
-            reply_markup=get_location_keyboard()
-        )
-        await state.set_state(BotStates.waiting_location)
-    
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        "🔍 <b>Поиск ближайшей станции</b>\n\n"
+        "Отправьте вашу геолокацию:",
+        reply_markup=get_location_keyboard()
+    )).side(state.set_state(BotStates.waiting_location)).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "prices")
 async def callback_prices(callback: CallbackQuery):
     """Цены"""
-    try:
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text="📋 Абонемент", callback_data="subscription"),
-            InlineKeyboardButton(text="📞 Связаться", callback_data="operator")
-        )
-        builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
-        
-        await callback.message.edit_text(
-            "💰 <b>Цены и тарифы</b>\n\n"
-            "<b>🛴 Разовые зарядки:</b>\n"
-            "• Электросамокаты: <b>от 150₽</b>\n"
-            "• Электровелосипеды: <b>от 200₽</b>\n\n"
-            "<b>📅 Абонементы:</b>\n"
-            "• Базовый: <b>999₽/месяц</b>\n"
-            "  └ Неограниченные зарядки\n"
-            "  └ Приоритетный доступ\n\n"
-            "<b>💳 Оплата:</b> карта, QR, Telegram",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logger.error(f"Ошибка в callback_prices: {e}")
-        await callback.message.answer(
-            "💰 <b>Цены и тарифы</b>\n\n"
-            "Электросамокаты: от 150₽\n"
-            "Электровелосипеды: от 200₽\n"
-            "Абонементы: от 999₽/месяц",
-            reply_markup=get_main_keyboard()
-        )
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="📋 Абонемент", callback_data="subscription"),
+        InlineKeyboardButton(text="📞 Связаться", callback_data="operator")
+    )
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
     
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        get_user_city(callback.from_user.id).render("prices_short", prices_short_text),
+        reply_markup=builder.as_markup()
+    )).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "schedule")
 async def callback_schedule(callback: CallbackQuery):
     """Режим работы"""
-    try:
-        active = [s for s in STATIONS if s["status"] == "active"]
-        coming_soon = [s for s in STATIONS if s["status"] == "coming_soon"]
-        
-        text = f"⏰ <b>Режим работы</b>\n\n🟢 Работает: {len(active)} станций\n\n"
-        for s in active:
-            text += f"• {s['name']} - {s['address']}\n"
-        
-        if coming_soon:
-            text += f"\n🚧 Скоро откроются: {len(coming_soon)} станций\n"
-            for s in coming_soon:
-                text += f"• {s['name']} - {s['address']} ({s.get('opens', 'Скоро')})\n"
-        
-        text += "\n💡 Все станции работают <b>24/7</b>!"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
-        ]])
-        
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except Exception as e:
-        logger.error(f"Ошибка в callback_schedule: {e}")
-        await callback.message.answer(
-            "⏰ <b>Режим работы</b>\n\nВсе станции работают <b>24/7</b>!",
-            reply_markup=get_main_keyboard()
-        )
+    text = get_user_city(callback.from_user.id).render("schedule_short", schedule_short_text)
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
+    ]])
     
-    await callback.answer()
+    await ReplyPlan().message(
+        edit_or_send(callback.message, text, reply_markup=keyboard)
+    ).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "subscription")
 async def callback_subscription(callback: CallbackQuery):
     """Абонементы"""
-    try:
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text="📞 Оформить", callback_data="operator"),
-            InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
-        )
-        
-        await callback.message.edit_text(
-            "📋 <b>Абонементы</b>\n\n"
-            "<b>🎯 Преимущества:</b>\n"
-            "✅ Неограниченные зарядки\n"
-            "✅ Приоритетный доступ\n"
-            "✅ Экономия до 50%\n\n"
-            "<b>💰 От 999₽/месяц</b>\n\n"
-            "Для оформления свяжитесь с нами:",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logger.error(f"Ошибка в callback_subscription: {e}")
-        await callback.message.answer(
-            "📋 <b>Абонементы</b>\n\n"
-            "От 999₽/месяц - неограниченные зарядки!",
-            reply_markup=get_main_keyboard()
-        )
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="📞 Оформить", callback_data="operator"),
+        InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
+    )
     
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        get_user_city(callback.from_user.id).render("subscription_short", subscription_short_text),
+        reply_markup=builder.as_markup()
+    )).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "operator")
 async def callback_operator(callback: CallbackQuery):
     """Оператор"""
-    try:
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text="📧 Email", url="mailto:info@voltstationnv.ru"),
-            InlineKeyboardButton(text="📞 Телефон", url="tel:+78001234567")
-        )
-        builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
-        
-        await callback.message.edit_text(
-            "👨‍💼 <b>Связь с оператором</b>\n\n"
-            "📧 Email: info@voltstationnv.ru\n"
-            "📞 Телефон: +7 (800) 123-45-67\n"
-            "🌐 Сайт: voltstationnv.ru\n\n"
-            "⏰ Время работы: 9:00 - 21:00 (МСК)",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logger.error(f"Ошибка в callback_operator: {e}")
-        await callback.message.answer(
-            "👨‍💼 <b>Связь с оператором</b>\n\n"
-            "📧 Email: info@voltstationnv.ru\n"
-            "📞 Телефон: +7 (800) 123-45-67",
-            reply_markup=get_main_keyboard()
-        )
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="📧 Email", url="mailto:info@voltstationnv.ru"),
+        InlineKeyboardButton(text="📞 Телефон", url="tel:+78001234567")
+    )
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
     
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        "👨‍💼 <b>Связь с оператором</b>\n\n"
+        "📧 Email: info@voltstationnv.ru\n"
+        "📞 Телефон: +7 (800) 123-45-67\n"
+        "🌐 Сайт: voltstationnv.ru\n\n"
+        "⏰ Время работы: 9:00 - 21:00 (МСК)",
+        reply_markup=builder.as_markup()
+    )).side(callback.answer()).run()
 
 
 @dp.callback_query(F.data == "help")
 async def callback_help(callback: CallbackQuery):
     """Помощь"""
-    try:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
-        ]])
-        
-        await callback.message.edit_text(
-            "❓ <b>Помощь</b>\n\n"
-            "<b>Команды:</b>\n"
-            "/start - начать\n"
-            "/find - найти станцию\n"
-            "/prices - цены\n"
-            "/schedule - режим работы\n"
-            "/subscription - абонементы\n"
-            "/operator - оператор\n\n"
-            "💡 Или просто задайте вопрос текстом!",
-            reply_markup=keyboard
-        )
-    except Exception as e:
-        logger.error(f"Ошибка в callback_help: {e}")
-        await callback.message.answer(
-            "❓ <b>Помощь</b>\n\n"
-            "Используйте команды или задайте вопрос!",
-            reply_markup=get_main_keyboard()
-        )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main")
+    ]])
     
-    await callback.answer()
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        "❓ <b>Помощь</b>\n\n"
+        "<b>Команды:</b>\n"
+        "/start - начать\n"
+        "/find - найти станцию\n"
+        "/prices - цены\n"
+        "/schedule - режим работы\n"
+        "/subscription - абонементы\n"
+        "/operator - оператор\n"
+        "/city - выбрать город\n\n"
+        "💡 Или просто задайте вопрос текстом!",
+        reply_markup=keyboard
+    )).side(callback.answer()).run()
+
+
+@dp.callback_query(F.data.startswith("city_"))
+async def callback_city(callback: CallbackQuery):
+    """Выбор города"""
+    key = callback.data.removeprefix("city_")
+    if key not in catalog:
+        await callback.answer("❌ Город не найден", show_alert=True)
+        return
+    
+    user_cities.set(callback.from_user.id, key)
+    city = catalog.get(key)
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        f"🏙 <b>Ваш город: {city.name}</b>\n\n"
+        f"Станций в городе: {len(city)}",
+        reply_markup=get_city_keyboard(city)
+    )).side(callback.answer(f"Город: {city.name}")).run()
 
 
 @dp.callback_query(F.data.startswith("map_"))
@@ -826,15 +1366,16 @@ async def callback_map(callback: CallbackQuery):
     """Показать станцию на карте"""
     try:
         station_id = int(callback.data.split("_")[1])
-        station = next((s for s in STATIONS if s["id"] == station_id), None)
+        station = catalog.station(station_id)
         
         if station:
-            await bot.send_location(
-                callback.message.chat.id,
-                latitude=station["lat"],
-                longitude=station["lon"]
+            event_log.emit(
+                "map_view", user_id=callback.from_user.id,
+                city=station["city"], station_id=station_id
             )
-            await callback.answer("📍 Карта отправлена")
+            await ReplyPlan().message(
+                send_station_venue(callback.message.chat.id, station)
+            ).side(callback.answer("📍 Карта отправлена")).run()
         else:
             await callback.answer("❌ Станция не найдена", show_alert=True)
     except (ValueError, IndexError) as e:
@@ -842,59 +1383,186 @@ async def callback_map(callback: CallbackQuery):
         await callback.answer("❌ Ошибка обработки запроса", show_alert=True)
 
 
+@dp.callback_query(F.data.startswith("alert_"))
+async def callback_alert(callback: CallbackQuery):
+    """Подписка на освобождение слота рядом со станцией"""
+    try:
+        _, station_id, radius = callback.data.split("_")
+        station = catalog.station(int(station_id))
+        radius = float(radius)
+    except ValueError as e:
+        logger.error(f"Ошибка обработки callback alert_: {e}")
+        await callback.answer("❌ Ошибка обработки запроса", show_alert=True)
+        return
+    
+    if not station:
+        await callback.answer("❌ Станция не найдена", show_alert=True)
+        return
+    
+    alert_index.subscribe(
+        callback.from_user.id,
+        callback.message.chat.id,
+        station["lat"], station["lon"],
+        radius
+    )
+    event_log.emit(
+        "alert_subscribe", user_id=callback.from_user.id,
+        city=station["city"], station_id=station["id"], radius=radius
+    )
+    await callback.answer(
+        f"🔔 Сообщу, когда в {radius:g} км от станции освободится слот",
+        show_alert=True
+    )
+
+
+@dp.callback_query(F.data.startswith("reserve_"))
+async def callback_reserve(callback: CallbackQuery):
+    """Забронировать слот на станции"""
+    try:
+        station_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logger.error(f"Ошибка обработки callback reserve_: {e}")
+        await callback.answer("❌ Ошибка обработки запроса", show_alert=True)
+        return
+    
+    station = catalog.station(station_id)
+    if not station or station["status"] != "active":
+        await callback.answer("❌ Станция не найдена", show_alert=True)
+        return
+    
+    try:
+        reservation = await reservation_engine.reserve(callback.from_user.id, station_id)
+    except ReservationError as e:
+        event_log.emit(
+            "reserve_failed", user_id=callback.from_user.id,
+            city=station["city"], station_id=station_id, reason=str(e)
+        )
+        await callback.answer(str(e), show_alert=True)
+        return
+    
+    event_log.emit(
+        "reserve", user_id=callback.from_user.id,
+        city=station["city"], station_id=station_id, reservation_id=reservation["id"]
+    )
+    
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(
+        text="❌ Отменить бронь",
+        callback_data=f"unreserve_{reservation['id']}"
+    ))
+    builder.row(InlineKeyboardButton(text="📍 Показать на карте", callback_data=f"map_{station_id}"))
+    
+    expires = datetime.fromtimestamp(reservation["expires_at"]).strftime("%H:%M")
+    await ReplyPlan().message(callback.message.answer(
+        f"✅ <b>Слот забронирован</b>\n\n"
+        f"⚡ {station['name']} - {station['address']}\n"
+        f"🎫 Бронь №{reservation['id']}\n"
+        f"⏳ Действует до {expires} ({RESERVATION_HOLD // 60} мин)",
+        reply_markup=builder.as_markup()
+    )).side(callback.answer("🔒 Забронировано")).run()
+
+
+@dp.callback_query(F.data.startswith("unreserve_"))
+async def callback_unreserve(callback: CallbackQuery):
+    """Отменить бронь"""
+    try:
+        reservation_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError) as e:
+        logger.error(f"Ошибка обработки callback unreserve_: {e}")
+        await callback.answer("❌ Ошибка обработки запроса", show_alert=True)
+        return
+    
+    if await reservation_engine.cancel(callback.from_user.id, reservation_id):
+        event_log.emit("unreserve", user_id=callback.from_user.id, reservation_id=reservation_id)
+        await ReplyPlan().message(edit_or_send(
+            callback.message,
+            "🔓 <b>Бронь отменена</b>\n\nСлот снова доступен другим.",
+            reply_markup=get_main_keyboard()
+        )).side(callback.answer()).run()
+    else:
+        await callback.answer("Бронь уже истекла или отменена", show_alert=True)
+
+
+@dp.callback_query(F.data == "alerts_off")
+async def callback_alerts_off(callback: CallbackQuery):
+    """Отключить уведомления"""
+    alert_index.unsubscribe(callback.from_user.id)
+    await ReplyPlan().message(edit_or_send(
+        callback.message,
+        "🔕 <b>Уведомления отключены</b>",
+        reply_markup=get_main_keyboard()
+    )).side(callback.answer()).run()
+
+
 # ==================== ОБРАБОТЧИКИ СООБЩЕНИЙ ====================
 
 @dp.message(F.location)
 async def handle_location(message: Message, state: FSMContext):
     """Обработка геолокации"""
     stats["messages"] += 1
-    stats["stations_found"] += 1
     
-    user_lat = message.location.latitude
-    user_lon = message.location.longitude
+    await reply_with_nearest(
+        message, state,
+        message.location.latitude,
+        message.location.longitude
+    )
+
+
+async def reply_with_nearest(message: Message, state: FSMContext, user_lat: float, user_lon: float,
+                             source: str = "location"):
+    """Ответить списком ближайших к точке станций"""
+    stats["stations_found"] += 1
+    remember_location(message.from_user.id, user_lat, user_lon)
     
-    nearest = find_nearest_stations(user_lat, user_lon, limit=3)
+    nearest = await find_nearest_stations(user_lat, user_lon, limit=3)
+    # Точку округляем до ~100 м: для карты спроса точнее не нужно
+    event_log.emit(
+        "nearest", user_id=message.from_user.id, chat_id=message.chat.id,
+        city=nearest[0]["city"] if nearest else None,
+        station_id=nearest[0]["id"] if nearest else None,
+        lat=round(user_lat, 3), lon=round(user_lon, 3),
+        source=source, stations=[s["id"] for s in nearest]
+    )
     
     if not nearest:
-        await message.answer(
+        await ReplyPlan().message(message.answer(
             "❌ <b>Станции не найдены</b>\n\n"
             "К сожалению, поблизости нет доступных станций.\n"
             "Но мы активно расширяем сеть!",
             reply_markup=get_main_keyboard()
-        )
-        await state.clear()
+        )).side(state.clear()).run()
         return
     
-    # Отправляем карту с первой станцией
-    await bot.send_location(
-        message.chat.id,
-        latitude=nearest[0]["lat"],
-        longitude=nearest[0]["lon"]
-    )
-    
-    # Формируем ответ
-    text = "📍 <b>Найдено станций рядом с вами:</b>\n\n"
-    
-    for i, station in enumerate(nearest, 1):
-        text += f"<b>{i}. {station['name']}</b>\n"
-        text += f"📍 {station['address']}\n"
-        text += f"📏 {station['distance']:.2f} км\n"
-        text += f"🔌 {station['available']}/{station['slots']} свободно\n"
-        text += f"💰 от {station['price_scooter']}₽\n\n"
-    
-    text += "💡 <b>Нажмите на станцию для подробной информации</b>"
-    
-    # Клавиатура со станциями
+    # Клавиатура со станциями: расстояние и свободные слоты видны сразу на кнопках
     builder = InlineKeyboardBuilder()
     for station in nearest:
+        how_far = format_travel_time(station) or f"{station['distance']:.1f} км"
         builder.row(InlineKeyboardButton(
-            text=f"📍 {station['name']} ({station['distance']:.1f} км)",
+            text=(
+                f"📍 {station['name']} · {how_far} · "
+                f"🔌 {station['available']}/{station['slots']}"
+            ),
             callback_data=f"station_{station['id']}"
         ))
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_main"))
     
-    await message.answer(text, reply_markup=builder.as_markup())
-    await state.clear()
+    # Карта с ближайшей станцией и список остальных - одним сообщением
+    nearest_station = nearest[0]
+    await ReplyPlan().message(send_station_venue(
+        message.chat.id,
+        nearest_station,
+        title=" · ".join(filter(None, (
+            f"⚡ {nearest_station['name']}",
+            f"{nearest_station['distance']:.2f} км",
+            format_travel_time(nearest_station)
+        ))),
+        address=(
+            f"{nearest_station['address']} · свободно "
+            f"{nearest_station['available']}/{nearest_station['slots']} · "
+            f"от {nearest_station['price_scooter']}₽"
+        ),
+        reply_markup=builder.as_markup()
+    )).side(state.clear()).run()
 
 
 @dp.callback_query(F.data.startswith("station_"))
@@ -902,56 +1570,209 @@ async def callback_station_info(callback: CallbackQuery):
     """Информация о станции"""
     try:
         station_id = int(callback.data.split("_")[1])
-        # Ищем станцию в STATIONS, но также проверяем, есть ли она в кэше с расстоянием
-        station = next((s for s in STATIONS if s["id"] == station_id), None)
+        station = catalog.station(station_id)
         
         if not station:
             await callback.answer("❌ Станция не найдена", show_alert=True)
             return
         
-        # Создаём копию станции для безопасного форматирования
-        station_copy = station.copy()
-        
-        # Проверяем, есть ли расстояние (если станция была найдена через геолокацию)
-        has_distance = "distance" in station_copy
+        # Расстояние считаем от геопозиции этого пользователя
+        station = station.copy()
+        location = get_last_location(callback.from_user.id)
+        if location:
+            station["distance"] = distance_km(*location, station["lat"], station["lon"])
         
-        try:
-            await callback.message.edit_text(
-                format_station_info(station_copy, include_distance=has_distance),
-                reply_markup=get_station_keyboard(station_id)
-            )
-        except Exception as e:
-            # Если не удалось отредактировать, отправляем новое сообщение
-            logger.warning(f"Не удалось отредактировать сообщение: {e}")
-            await callback.message.answer(
-                format_station_info(station_copy, include_distance=has_distance),
-                reply_markup=get_station_keyboard(station_id)
-            )
+        event_log.emit(
+            "station_view", user_id=callback.from_user.id, chat_id=callback.message.chat.id,
+            city=station["city"], station_id=station_id,
+            distance_km=round(station["distance"], 2) if location else None
+        )
         
-        await callback.answer()
+        await ReplyPlan().message(
+            send_station_card(callback.message, station)
+        ).side(callback.answer()).run()
     except (ValueError, IndexError) as e:
         logger.error(f"Ошибка обработки callback station_: {e}")
         await callback.answer("❌ Ошибка обработки запроса", show_alert=True)
 
 
 @dp.message(F.text & ~F.text.startswith('/'))
-async def handle_text_message(message: Message):
-    """Обработка текстовых сообщений через ИИ"""
+async def handle_text_message(message: Message, state: FSMContext):
+    """Обработка текстовых сообщений: адрес ищем офлайн, остальное - через ИИ"""
     stats["messages"] += 1
     
     if not message.text or len(message.text.strip()) < 2:
         return
     
-    # Показываем индикатор печати
-    await bot.send_chat_action(message.chat.id, "typing")
+    # Если пользователь просто написал адрес - ИИ не нужен
+    address = geocoder.geocode(message.text)
+    if address:
+        logger.info(f"Адрес распознан: {address['street']}, {address['house']} (опечаток: {address['typos']})")
+        await reply_with_nearest(message, state, address["lat"], address["lon"], source="address")
+        return
+    
+    # Готовые ответы подходят для общих вопросов, в том числе о ценах зарядки и
+    # о том, как найти станцию; вопросы о свободных местах рядом с пользователем - нет
+    city = get_user_city(message.from_user.id)
+    if not needs_live_data(message.text, message.from_user.id, city):
+        started = time.perf_counter()
+        found = faq_store.answer(message.text, city.key, city.system_prompt)
+        if found:
+            similarity, answer = found
+            stats["faq_answers"] += 1
+            dialog_memory.add_turn(message.from_user.id, message.text, answer)
+            event_log.emit(
+                "faq_answer", user_id=message.from_user.id, city=city.key,
+                duration_ms=(time.perf_counter() - started) * 1000,
+                similarity=round(similarity, 3)
+            )
+            await message.answer(answer, reply_markup=get_main_keyboard())
+            return
+    
+    context = build_station_context(message.text, message.from_user.id)
     
-    # Получаем ответ от GigaChat
-    response = await ask_gigachat(message.text)
+    # Индикатор печати показываем параллельно с запросом к GigaChat
+    _, response = await asyncio.gather(
+        bot.send_chat_action(message.chat.id, "typing"),
+        ask_gigachat(message.text, context=context, user_id=message.from_user.id)
+    )
     
     # Отправляем ответ с клавиатурой
     await message.answer(response, reply_markup=get_main_keyboard())
 
 
+# ==================== ИНЛАЙН-РЕЖИМ ====================
+
+@dp.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """Поиск станций из любого чата: @bot ленина"""
+    stats["inline_queries"] += 1
+    started = time.perf_counter()
+    
+    # С геопозицией ищем в городе, где находится пользователь, и ранжируем
+    # по расстоянию - ответ становится персональным
+    location = inline_query.location
+    if location:
+        city = catalog.for_location(location.latitude, location.longitude)
+    else:
+        city = get_user_city(inline_query.from_user.id)
+    stations = [city.stations_by_id[i] for i in city.search(inline_query.query.strip())]
+    
+    distances = {}
+    if location:
+        for s in stations:
+            distances[s["id"]] = distance_km(
+                location.latitude, location.longitude, s["lat"], s["lon"]
+            )
+        stations.sort(key=lambda s: (s["status"] != "active", distances[s["id"]]))
+    
+    results = []
+    for s in stations[:INLINE_RESULTS_LIMIT]:
+        if s["status"] == "active":
+            title = f"⚡ {s['name']} · свободно {s.get('available', 0)}/{s['slots']}"
+        else:
+            title = f"🚧 {s['name']} · откроется {s.get('opens', 'скоро')}"
+        if s["id"] in distances:
+            title += f" · {distances[s['id']]:.1f} км"
+        results.append(InlineQueryResultVenue(
+            id=str(s["id"]),
+            latitude=s["lat"],
+            longitude=s["lon"],
+            title=title,
+            address=s["address"]
+        ))
+    
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        # Выдача зависит от города пользователя, если городов несколько
+        is_personal=bool(location) or len(CITIES) > 1
+    )
+    event_log.emit(
+        "inline_search", user_id=inline_query.from_user.id, city=city.key,
+        duration_ms=(time.perf_counter() - started) * 1000,
+        query=inline_query.query[:64], results=len(results), with_location=bool(location)
+    )
+    logger.debug(f"Инлайн-запрос '{inline_query.query}': {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+# ==================== API СТАНЦИЙ ====================
+
+# (город, bbox) -> готовые тела ответа; ответ пересобирается при смене версии города
+stations_api_cache: "OrderedDict[Tuple[str, Optional[Tuple[float, ...]]], Dict]" = OrderedDict()
+
+
+def parse_bbox(value: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """bbox=minLon,minLat,maxLon,maxLat; округляем, чтобы не плодить варианты кэша"""
+    if not value:
+        return None
+    parts = [round(float(p), 4) for p in value.split(",")]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError(value)
+    return tuple(parts)
+
+
+def build_stations_payload(city: City, bbox: Optional[Tuple[float, ...]]) -> Dict:
+    """Сериализовать и сжать список станций города один раз"""
+    stations = city.stations
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        stations = [
+            s for s in city.stations
+            if min_lon <= s["lon"] <= max_lon and min_lat <= s["lat"] <= max_lat
+        ]
+    
+    body = json.dumps(
+        {
+            "city": city.key,
+            "version": city.version,
+            "stations": [public_station(s) for s in stations]
+        },
+        ensure_ascii=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+    
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+    if brotli:
+        variants["br"] = brotli.compress(body, quality=11)
+    return {
+        "version": city.version,
+        "etag": hashlib.blake2b(body, digest_size=12).hexdigest(),
+        "variants": variants
+    }
+
+
+def get_stations_payload(city: City, bbox: Optional[Tuple[float, ...]]) -> Dict:
+    """Готовый ответ из кэша; пересобирается только после изменения станций города"""
+    key = (city.key, bbox)
+    payload = stations_api_cache.get(key)
+    if payload is None or payload["version"] != city.version:
+        payload = build_stations_payload(city, bbox)
+        stations_api_cache[key] = payload
+        while len(stations_api_cache) > STATIONS_API_CACHE_SIZE:
+            stations_api_cache.popitem(last=False)
+    stations_api_cache.move_to_end(key)
+    return payload
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """Лучшее сжатие из поддерживаемых клиентом"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, 0) > 0:
+            return encoding
+    return "identity"
+
+
 # ==================== HTTP СЕРВЕР ДЛЯ RENDER ====================
 
 async def start_web_server():
@@ -968,13 +1789,107 @@ async def start_web_server():
                 "users": len(stats["users"]),
                 "messages": stats["messages"],
                 "stations_found": stats["stations_found"],
-                "ai_requests": stats["ai_requests"]
+                "ai_requests": stats["ai_requests"],
+                "ai_avg_prompt_tokens": round(stats["ai_prompt_tokens"] / max(stats["ai_requests"], 1)),
+                "ai_avg_latency_ms": round(stats["ai_latency_ms"] / max(stats["ai_requests"], 1)),
+                "inline_queries": stats["inline_queries"],
+                "faq_answers": stats["faq_answers"],
+                "alert_subscriptions": len(alert_index),
+                "alerts_sent": alert_sender.sent,
+                "events_written": event_log.written,
+                "events_dropped": event_log.dropped,
+                "media_cached": len(station_media.cache),
+                "media_uploads": station_media.uploads,
+                "event_loop": loop_monitor.stats(),
+                "updates": update_gate.stats(),
+                "cities_loaded": [c.key for c in catalog.loaded()],
+                "dialogs": len(dialog_memory)
             })
         
+        async def stations_api(request):
+            try:
+                bbox = parse_bbox(request.query.get("bbox"))
+            except ValueError:
+                return web.json_response(
+                    {"error": "bbox должен быть в формате minLon,minLat,maxLon,maxLat"},
+                    status=400,
+                    headers={"Access-Control-Allow-Origin": "*"}
+                )
+            
+            city_key = request.query.get("city", DEFAULT_CITY)
+            if city_key not in catalog:
+                return web.json_response(
+                    {"error": f"неизвестный город: {city_key}"},
+                    status=404,
+                    headers={"Access-Control-Allow-Origin": "*"}
+                )
+            
+            payload = get_stations_payload(catalog.get(city_key), bbox)
+            encoding = choose_encoding(request.headers.get("Accept-Encoding", ""), payload["variants"])
+            # У каждого варианта сжатия свой строгий ETag
+            etag = f'"{payload["etag"]}"' if encoding == "identity" else f'"{payload["etag"]}-{encoding}"'
+            headers = {
+                "ETag": etag,
+                "Cache-Control": f"public, max-age={STATIONS_API_MAX_AGE}",
+                "Vary": "Accept-Encoding",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Expose-Headers": "ETag"
+            }
+            
+            if_none_match = request.headers.get("If-None-Match", "")
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",") if t.strip()]
+            if "*" in tags or etag in tags:
+                return web.Response(status=304, headers=headers)
+            
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            return web.Response(
+                body=payload["variants"][encoding],
+                content_type="application/json",
+                charset="utf-8",
+                headers=headers
+            )
+        
         app = web.Application()
         app.router.add_get('/', health_check)
         app.router.add_get('/health', health_check)
         app.router.add_get('/stats', stats_endpoint)
+        app.router.add_get('/api/stations', stations_api)
+        
+        # Отладочные эндпоинты доступны только при заданном DEBUG_TOKEN. Токен
+        # принимается только в заголовке: строка запроса попадает в access log
+        def debug_allowed(request) -> bool:
+            token = request.headers.get("X-Debug-Token", "")
+            return hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+        
+        async def debug_profile(request):
+            if not debug_allowed(request):
+                return web.Response(status=403)
+            try:
+                seconds = min(float(request.query.get("seconds", 5)), DEBUG_PROFILE_MAX_SECONDS)
+            except ValueError:
+                return web.Response(status=400, text="seconds должно быть числом")
+            # Сэмплируем поток цикла событий из отдельного потока
+            profile = await asyncio.to_thread(sample_profile, threading.get_ident(), seconds)
+            return web.Response(text=format_profile(profile))
+        
+        async def debug_tasks(request):
+            if not debug_allowed(request):
+                return web.Response(status=403)
+            return web.Response(text=dump_tasks())
+        
+        async def debug_memory(request):
+            if not debug_allowed(request):
+                return web.Response(status=403)
+            if request.query.get("action") == "stop":
+                return web.Response(text=memory_tracker.stop())
+            # Разбор снимка занимает сотни миллисекунд - не держим цикл событий
+            return web.Response(text=await asyncio.to_thread(memory_tracker.snapshot_diff))
+        
+        if DEBUG_TOKEN:
+            app.router.add_get('/debug/profile', debug_profile)
+            app.router.add_get('/debug/tasks', debug_tasks)
+            app.router.add_get('/debug/memory', debug_memory)
         
         port = int(os.getenv("PORT", 8000))
         runner = web.AppRunner(app)
@@ -990,6 +1905,15 @@ async def start_web_server():
 
 # ==================== ГЛАВНАЯ ФУНКЦИЯ ====================
 
+async def load_road_graph():
+    """Загрузить дорожный граф в отдельном потоке, не задерживая запуск бота"""
+    global road_router
+    try:
+        road_router = await asyncio.to_thread(RoadRouter.from_osm, ROAD_GRAPH_PATH)
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить дорожный граф: {e}")
+
+
 async def main():
     """Главная функция запуска"""
     logger.info("=" * 60)
@@ -1008,8 +1932,18 @@ async def main():
     except Exception as e:
         logger.warning(f"⚠️ Webhook: {e}")
     
-    # Запускаем HTTP сервер
+    # Запускаем HTTP сервер и фоновые службы
+    loop_monitor.start()
     web_runner = await start_web_server()
+    road_graph_task = asyncio.create_task(load_road_graph())
+    alert_sender.start()
+    alert_index.start(ALERT_PURGE_INTERVAL)
+    event_log.start()
+    user_cities.start(USER_CITIES_FLUSH_INTERVAL)
+    # Город по умолчанию нужен почти каждому запросу - грузим его сразу,
+    # остальные подгрузятся при первом обращении
+    catalog.get(DEFAULT_CITY)
+    await reservation_engine.open([s for city in catalog.loaded() for s in city.stations])
     
     logger.info("🤖 Бот запущен и готов к работе!")
     logger.info("=" * 60)
@@ -1023,6 +1957,13 @@ async def main():
         import traceback
         logger.error(traceback.format_exc())
     finally:
+        await alert_sender.stop()
+        await alert_index.stop()
+        await event_log.stop()
+        await user_cities.stop()
+        await reservation_engine.close()
+        await loop_monitor.stop()
+        road_graph_task.cancel()
         if web_runner:
             await web_runner.cleanup()
         await bot.session.close()
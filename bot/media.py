@@ -0,0 +1,166 @@
+"""
+VoltStation - картинки карточек станций
+Фото станции или статичная карта загружаются в Telegram один раз, дальше - по file_id
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Optional, Dict, Tuple, Callable, Awaitable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, URLInputFile, InputFile, InputMediaPhoto, Message
+
+from storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PHOTOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stations")
+DEFAULT_STATIC_MAP_URL = (
+    "https://static-maps.yandex.ru/1.x/?ll={lon},{lat}&z={zoom}&size=650,450&l=map&pt={lon},{lat},pm2rdl"
+)
+STATIC_MAP_ZOOM = 16
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """Хэш содержимого файла; файл перечитывается, только если изменились mtime или размер"""
+    st = os.stat(path)
+    return _file_digest(path, st.st_mtime_ns, st.st_size)
+
+
+class FileIdCache:
+    """Постоянный кэш file_id загруженных картинок
+
+    Запись - ключ картинки -> (хэш содержимого, file_id). file_id выдаётся,
+    только если хэш совпадает, поэтому изменённая картинка загружается заново,
+    а неизменные переживают перезапуск бота. Файл кэша перезаписывается
+    атомарно в отдельном потоке.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        self._save_lock = asyncio.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Кэш file_id {path} не прочитан, начинаем заново: {e}")
+        logger.info(f"✅ Кэш file_id: записей - {len(self.entries)}")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str, digest: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry and entry["hash"] == digest:
+            return entry["file_id"]
+        return None
+
+    async def put(self, key: str, digest: str, file_id: str):
+        self.entries[key] = {"hash": digest, "file_id": file_id}
+        await self._save()
+
+    async def invalidate(self, key: str):
+        if self.entries.pop(key, None) is not None:
+            await self._save()
+
+    async def _save(self):
+        async with self._save_lock:
+            await asyncio.to_thread(write_json_atomic, self.path, dict(self.entries), ensure_ascii=False)
+
+
+class StationMedia:
+    """Картинка для карточки станции: фото из data/stations/<id>.jpg или статичная карта
+
+    Хэш фото считается по содержимому файла, хэш карты - по параметрам запроса
+    (координаты, масштаб), поэтому карта перезагружается только при переносе
+    станции. Одновременные запросы одной картинки ждут первую загрузку, а не
+    загружают её параллельно.
+    """
+
+    def __init__(self, cache: FileIdCache, photos_dir: str = DEFAULT_PHOTOS_DIR,
+                 map_url: str = DEFAULT_STATIC_MAP_URL):
+        self.cache = cache
+        self.photos_dir = photos_dir
+        self.map_url = map_url
+        self.uploads = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def image_for(self, station: Dict) -> Tuple[str, str, Callable[[], InputFile]]:
+        """Ключ кэша, хэш содержимого и фабрика файла для загрузки"""
+        photo = os.path.join(self.photos_dir, f"{station['id']}.jpg")
+        if os.path.exists(photo):
+            return f"{station['id']}:photo", file_digest(photo), lambda: FSInputFile(photo)
+
+        url = self.map_url.format(lat=station["lat"], lon=station["lon"], zoom=STATIC_MAP_ZOOM)
+        digest = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+        return (
+            f"{station['id']}:map", digest,
+            lambda: URLInputFile(url, filename=f"station_{station['id']}.png")
+        )
+
+    async def send_card(self, bot: Bot, chat_id: int, station: Dict, caption: str,
+                        reply_markup=None) -> Message:
+        """Отправить карточку станции: по file_id, а если его нет - загрузкой картинки"""
+        return await self._deliver(
+            station,
+            lambda photo: bot.send_photo(chat_id, photo, caption=caption, reply_markup=reply_markup)
+        )
+
+    async def edit_card(self, bot: Bot, chat_id: int, message_id: int, station: Dict, caption: str,
+                        reply_markup=None) -> Message:
+        """Заменить картинку и подпись в уже отправленной карточке"""
+        return await self._deliver(
+            station,
+            lambda photo: bot.edit_message_media(
+                InputMediaPhoto(media=photo, caption=caption),
+                chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+            )
+        )
+
+    async def _deliver(self, station: Dict, put: Callable[[object], Awaitable[Message]]) -> Message:
+        """Показать картинку через put(file_id или файл) и запомнить её file_id"""
+        key, digest, make_file = self.image_for(station)
+
+        file_id = self.cache.get(key, digest)
+        if file_id:
+            try:
+                return await put(file_id)
+            except TelegramBadRequest as e:
+                if "file" not in e.message.lower():
+                    raise
+                logger.warning(f"file_id для {key} больше не действует ({e.message}), загружаем заново")
+                await self.cache.invalidate(key)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Пока ждали, картинку мог загрузить параллельный запрос
+                file_id = self.cache.get(key, digest)
+                if file_id:
+                    return await put(file_id)
+
+                message = await put(make_file())
+                self.uploads += 1
+                # Самый крупный вариант из присланных Telegram
+                await self.cache.put(key, digest, message.photo[-1].file_id)
+                logger.info(f"Картинка {key} загружена в Telegram")
+                return message
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
@@ -0,0 +1,314 @@
+"""
+VoltStation - бронирование слотов на станциях
+Атомарные счётчики слотов в SQLite и истечение брони через колесо таймеров
+"""
+
+import asyncio
+import logging
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Callable
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS station_slots (
+    station_id INTEGER PRIMARY KEY,
+    available  INTEGER NOT NULL CHECK (available >= 0),
+    version    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    station_id  INTEGER NOT NULL,
+    user_id     INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    expires_at  REAL NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'active'
+);
+-- Не больше одной активной брони на пользователя
+CREATE UNIQUE INDEX IF NOT EXISTS reservations_one_active
+    ON reservations (user_id) WHERE status = 'active';
+"""
+
+
+class ReservationError(Exception):
+    """Бронь невозможна; текст ошибки можно показать пользователю"""
+
+
+class TimerWheel:
+    """Колесо таймеров: O(1) на постановку и отмену, один тик на все брони
+
+    Ключ попадает в ячейку (позиция + задержка) по модулю размера колеса;
+    задержки длиннее оборота учитываются счётчиком оставшихся оборотов.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots = slots
+        self.buckets: List[Dict[int, int]] = [{} for _ in range(slots)]
+        self.position = 0
+        self._where: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key: int, delay: float):
+        """Запланировать срабатывание ключа через delay секунд"""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self.position + ticks) % self.slots
+        self.buckets[slot][key] = (ticks - 1) // self.slots
+        self._where[key] = slot
+
+    def cancel(self, key: int):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self.buckets[slot].pop(key, None)
+
+    def advance(self) -> List[int]:
+        """Сдвинуть колесо на один тик и вернуть сработавшие ключи"""
+        self.position = (self.position + 1) % self.slots
+        bucket = self.buckets[self.position]
+        due = []
+        for key, rounds in list(bucket.items()):
+            if rounds == 0:
+                due.append(key)
+                del bucket[key]
+                del self._where[key]
+            else:
+                bucket[key] = rounds - 1
+        return due
+
+
+class ReservationEngine:
+    """Бронирование слотов
+
+    Счётчик свободных слотов уменьшается условным UPDATE ... WHERE available > 0
+    внутри транзакции SQLite, поэтому слот не может уйти двум пользователям даже
+    при нескольких процессах бота на одной базе. Все запросы к базе идут в одном
+    выделенном потоке и не блокируют цикл событий.
+    """
+
+    def __init__(self, path: str, hold_seconds: float,
+                 on_change: Optional[Callable[[int, int], None]] = None):
+        self.path = path
+        self.hold_seconds = hold_seconds
+        self.on_change = on_change
+        self.wheel = TimerWheel()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reservations")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    # ---------- работа с базой (только в потоке executor) ----------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open_sync(self, stations: List[Dict]) -> Dict:
+        db = self._db()
+        db.executescript(SCHEMA)
+        available = self._add_stations_sync(stations)
+        active = [
+            dict(row) for row in db.execute(
+                "SELECT id, station_id, user_id, expires_at FROM reservations WHERE status = 'active'"
+            )
+        ]
+        return {"available": available, "active": active}
+
+    def _add_stations_sync(self, stations: List[Dict]) -> Dict[int, int]:
+        """Завести счётчики новых станций; результат - station_id -> свободно"""
+        if not stations:
+            return {}
+        db = self._db()
+        db.executemany(
+            "INSERT OR IGNORE INTO station_slots (station_id, available) VALUES (?, ?)",
+            [(s["id"], s.get("available", 0)) for s in stations]
+        )
+        ids = [s["id"] for s in stations]
+        return {
+            row["station_id"]: row["available"]
+            for row in db.execute(
+                f"SELECT station_id, available FROM station_slots "
+                f"WHERE station_id IN ({','.join('?' * len(ids))})",
+                ids
+            )
+        }
+
+    def _reserve_sync(self, user_id: int, station_id: int) -> Dict:
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            updated = db.execute(
+                "UPDATE station_slots SET available = available - 1, version = version + 1 "
+                "WHERE station_id = ? AND available > 0",
+                (station_id,)
+            ).rowcount
+            if not updated:
+                raise ReservationError("😔 Свободных слотов уже нет")
+            try:
+                cursor = db.execute(
+                    "INSERT INTO reservations (station_id, user_id, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (station_id, user_id, now, now + self.hold_seconds)
+                )
+            except sqlite3.IntegrityError:
+                raise ReservationError("У вас уже есть активная бронь")
+            available = db.execute(
+                "SELECT available FROM station_slots WHERE station_id = ?", (station_id,)
+            ).fetchone()["available"]
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return {
+            "id": cursor.lastrowid,
+            "station_id": station_id,
+            "user_id": user_id,
+            "expires_at": now + self.hold_seconds,
+            "available": available
+        }
+
+    def _release_sync(self, reservation_ids: List[int], status: str,
+                      user_id: Optional[int] = None) -> Dict[int, int]:
+        """Закрыть брони и вернуть слоты; результат - station_id -> свободно"""
+        db = self._db()
+        changed: Dict[int, int] = {}
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for reservation_id in reservation_ids:
+                query = "SELECT station_id FROM reservations WHERE id = ? AND status = 'active'"
+                params = [reservation_id]
+                if user_id is not None:
+                    query += " AND user_id = ?"
+                    params.append(user_id)
+                row = db.execute(query, params).fetchone()
+                if not row:
+                    continue
+                db.execute("UPDATE reservations SET status = ? WHERE id = ?", (status, reservation_id))
+                db.execute(
+                    "UPDATE station_slots SET available = available + 1, version = version + 1 "
+                    "WHERE station_id = ?",
+                    (row["station_id"],)
+                )
+                changed[row["station_id"]] = db.execute(
+                    "SELECT available FROM station_slots WHERE station_id = ?", (row["station_id"],)
+                ).fetchone()["available"]
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return changed
+
+    def _active_for_user_sync(self, user_id: int) -> Optional[Dict]:
+        row = self._db().execute(
+            "SELECT id, station_id, expires_at FROM reservations "
+            "WHERE user_id = ? AND status = 'active'",
+            (user_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---------- публичный API ----------
+
+    @property
+    def is_open(self) -> bool:
+        return self._ticker is not None
+
+    async def open(self, stations: List[Dict]):
+        """Подготовить базу, восстановить активные брони и запустить таймер"""
+        state = await self._call(self._open_sync, stations)
+        for station_id, available in state["available"].items():
+            self._notify(station_id, available)
+
+        now = time.time()
+        expired = []
+        for reservation in state["active"]:
+            if reservation["expires_at"] <= now:
+                expired.append(reservation["id"])
+            else:
+                self.wheel.schedule(reservation["id"], reservation["expires_at"] - now)
+        if expired:
+            await self._expire(expired)
+
+        self._ticker = asyncio.create_task(self._tick_loop())
+        logger.info(f"✅ Бронирование: активных броней - {len(self.wheel)}")
+
+    async def add_stations(self, stations: List[Dict]):
+        """Подключить станции, появившиеся после запуска (например, подгруженного города)"""
+        available = await self._call(self._add_stations_sync, stations)
+        for station_id, available_slots in available.items():
+            self._notify(station_id, available_slots)
+
+    async def close(self):
+        if self._ticker:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+            self._ticker = None
+        await self._call(self._close_sync)
+        self._executor.shutdown(wait=True)
+
+    async def reserve(self, user_id: int, station_id: int) -> Dict:
+        """Забронировать слот; при невозможности - ReservationError"""
+        reservation = await self._call(self._reserve_sync, user_id, station_id)
+        self.wheel.schedule(reservation["id"], self.hold_seconds)
+        self._notify(station_id, reservation["available"])
+        return reservation
+
+    async def cancel(self, user_id: int, reservation_id: int) -> bool:
+        """Отменить бронь пользователя"""
+        changed = await self._call(self._release_sync, [reservation_id], "cancelled", user_id)
+        self.wheel.cancel(reservation_id)
+        for station_id, available in changed.items():
+            self._notify(station_id, available)
+        return bool(changed)
+
+    async def get_active(self, user_id: int) -> Optional[Dict]:
+        """Активная бронь пользователя"""
+        return await self._call(self._active_for_user_sync, user_id)
+
+    async def _expire(self, reservation_ids: List[int]):
+        changed = await self._call(self._release_sync, reservation_ids, "expired")
+        for station_id, available in changed.items():
+            self._notify(station_id, available)
+        logger.info(f"Истекло броней: {len(reservation_ids)}")
+
+    async def _tick_loop(self):
+        """Раз в тик сдвигать колесо; пропущенные тики догоняются"""
+        next_tick = time.monotonic() + self.wheel.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            due = []
+            while next_tick <= time.monotonic():
+                due.extend(self.wheel.advance())
+                next_tick += self.wheel.tick
+            if due:
+                try:
+                    await self._expire(due)
+                except Exception as e:
+                    logger.error(f"Ошибка снятия истёкших броней: {e}")
+                    # Повторим на следующем тике
+                    for reservation_id in due:
+                        self.wheel.schedule(reservation_id, self.wheel.tick)
+
+    def _notify(self, station_id: int, available: int):
+        if self.on_change:
+            self.on_change(station_id, available)
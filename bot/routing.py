@@ -0,0 +1,313 @@
+"""
+VoltStation - время в пути до станций по дорожному графу
+Граф из выгрузки OpenStreetMap в компактных массивах, один поиск Дейкстры от точки до всех станций
+"""
+
+import gzip
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple, Hashable, Iterable
+
+from geo import distance_km
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRAPH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nizhnevartovsk.osm")
+
+# Средняя скорость самоката/велосипеда по типам дорог, км/ч.
+# Магистрали, где электротранспорту ездить нельзя, в граф не попадают.
+HIGHWAY_SPEEDS_KMH = {
+    "cycleway": 18,
+    "primary": 16, "primary_link": 16,
+    "secondary": 16, "secondary_link": 16,
+    "tertiary": 16, "tertiary_link": 16,
+    "unclassified": 15, "residential": 15,
+    "living_street": 10, "service": 12, "road": 12,
+    "track": 8, "path": 10, "footway": 8, "pedestrian": 8,
+}
+# Скорость на отрезке от точки до ближайшего узла графа
+APPROACH_SPEED_KMH = 10
+SNAP_CELL = 0.005        # ~500 м по широте
+GEOHASH_PRECISION = 7    # ячейка ~150x150 м
+ORIGIN_CACHE_SIZE = 4096
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+INF = float("inf")
+
+
+def geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Геохеш точки: соседние точки получают одинаковую строку"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def parse_osm(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[List[int], float]]]:
+    """Прочитать узлы и проезжие для самоката пути из .osm (можно .osm.gz)"""
+    nodes: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], float]] = []
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rb") as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "node":
+                nodes[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                speed = HIGHWAY_SPEEDS_KMH.get(tags.get("highway"))
+                closed = tags.get("access") in ("no", "private") or tags.get("bicycle") == "no"
+                if speed and not closed:
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    if len(refs) > 1:
+                        ways.append((refs, speed))
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+    return nodes, ways
+
+
+class RoadRouter:
+    """Дорожный граф и время в пути
+
+    Граф хранится в CSR-виде в массивах array: смещения рёбер по узлам, цели
+    и веса (секунды). Односторонние улицы не учитываются - самокат или
+    велосипед всегда можно провести по тротуару, - поэтому граф неориентированный,
+    и для каждого узла достаточно номера его компоненты связности, чтобы
+    сразу отсеивать недостижимые цели.
+    """
+
+    def __init__(self, lat: array, lon: array, offsets: array, targets: array, weights: array):
+        self.lat = lat
+        self.lon = lon
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.component = self._label_components()
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for node in range(len(lat)):
+            self._grid.setdefault(self._cell(lat[node], lon[node]), []).append(node)
+        # travel_times вызывается из потоков, кэш общий
+        self._origin_cache: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    # ---------- построение ----------
+
+    @classmethod
+    def from_osm(cls, path: str = DEFAULT_GRAPH_PATH) -> Optional["RoadRouter"]:
+        """Загрузить граф из выгрузки OSM; None, если файла нет"""
+        if not os.path.exists(path):
+            logger.warning(f"Дорожный граф не найден: {path}, ранжируем по прямой")
+            return None
+
+        started = time.monotonic()
+        nodes, ways = parse_osm(path)
+
+        # Оставляем только узлы, через которые проходят дороги
+        index: Dict[int, int] = {}
+        lat, lon = array("d"), array("d")
+        edges: List[Tuple[int, int, float]] = []
+        for refs, speed_kmh in ways:
+            speed = speed_kmh / 3.6
+            prev = None
+            for ref in refs:
+                if ref not in nodes:
+                    prev = None
+                    continue
+                node = index.get(ref)
+                if node is None:
+                    node = index[ref] = len(lat)
+                    lat.append(nodes[ref][0])
+                    lon.append(nodes[ref][1])
+                if prev is not None and prev != node:
+                    seconds = distance_km(lat[prev], lon[prev], lat[node], lon[node]) * 1000 / speed
+                    edges.append((prev, node, seconds))
+                prev = node
+        del nodes
+
+        # CSR: рёбра каждого узла лежат подряд
+        n = len(lat)
+        degree = [0] * (n + 1)
+        for a, b, _ in edges:
+            degree[a] += 1
+            degree[b] += 1
+        offsets = array("l", [0]) * (n + 1)
+        for i in range(n):
+            offsets[i + 1] = offsets[i] + degree[i]
+        fill = array("l", offsets)
+        targets = array("l", [0]) * (2 * len(edges))
+        weights = array("f", [0.0]) * (2 * len(edges))
+        for a, b, seconds in edges:
+            for u, v in ((a, b), (b, a)):
+                targets[fill[u]] = v
+                weights[fill[u]] = seconds
+                fill[u] += 1
+
+        router = cls(lat, lon, offsets, targets, weights)
+        logger.info(
+            f"✅ Дорожный граф: {n} узлов, {len(edges)} рёбер, "
+            f"{max(router.component, default=-1) + 1} компонент связности "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+        return router
+
+    def dijkstra(self, source: int) -> array:
+        """Время от узла до всех остальных"""
+        dist = array("d", [INF]) * len(self.lat)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > dist[v]:
+                continue
+            for i in range(offsets[v], offsets[v + 1]):
+                w = targets[i]
+                nd = d + weights[i]
+                if nd < dist[w]:
+                    dist[w] = nd
+                    heapq.heappush(heap, (nd, w))
+        return dist
+
+    def _label_components(self) -> array:
+        """Номер компоненты связности для каждого узла, один обход в ширину"""
+        component = array("l", [-1]) * len(self.lat)
+        offsets, targets = self.offsets, self.targets
+        label = 0
+        for start in range(len(component)):
+            if component[start] != -1:
+                continue
+            component[start] = label
+            stack = [start]
+            while stack:
+                v = stack.pop()
+                for i in range(offsets[v], offsets[v + 1]):
+                    w = targets[i]
+                    if component[w] == -1:
+                        component[w] = label
+                        stack.append(w)
+            label += 1
+        return component
+
+    # ---------- поиск ----------
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> Tuple[int, int]:
+        return int(lat // SNAP_CELL), int(lon // (SNAP_CELL * 2))
+
+    def snap(self, lat: float, lon: float) -> Optional[int]:
+        """Ближайший к точке узел графа"""
+        ci, cj = self._cell(lat, lon)
+        scale = math.cos(math.radians(lat)) ** 2
+        for radius in range(0, 4):
+            best, best_d = None, INF
+            for i in range(ci - radius, ci + radius + 1):
+                for j in range(cj - radius, cj + radius + 1):
+                    for node in self._grid.get((i, j), ()):
+                        d = (self.lat[node] - lat) ** 2 + (self.lon[node] - lon) ** 2 * scale
+                        if d < best_d:
+                            best, best_d = node, d
+            if best is not None:
+                return best
+        return None
+
+    def times_from(self, source: int, targets: Iterable[int], limit: Optional[int] = None) -> Dict[int, float]:
+        """Время от узла до целей (сек) одним поиском Дейкстры
+
+        Поиск останавливается, как только найдены все цели или limit ближайших
+        из них. Цели в других компонентах связности отбрасываются заранее,
+        иначе ради них пришлось бы обойти всю компоненту источника.
+        """
+        component = self.component[source]
+        pending = {t for t in targets if self.component[t] == component}
+        need = len(pending) if limit is None else min(limit, len(pending))
+        found: Dict[int, float] = {}
+        if not need:
+            return found
+
+        offsets, targets_, weights = self.offsets, self.targets, self.weights
+        best: Dict[int, float] = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > best.get(v, INF):
+                continue
+            if v in pending:
+                pending.discard(v)
+                found[v] = d
+                if len(found) >= need:
+                    break
+            for i in range(offsets[v], offsets[v + 1]):
+                w = targets_[i]
+                nd = d + weights[i]
+                if nd < best.get(w, INF):
+                    best[w] = nd
+                    heapq.heappush(heap, (nd, w))
+        return found
+
+    def _approach(self, lat: float, lon: float, node: int) -> float:
+        return distance_km(lat, lon, self.lat[node], self.lon[node]) * 1000 / (APPROACH_SPEED_KMH / 3.6)
+
+    def travel_times(self, lat: float, lon: float, destinations: Dict[int, Tuple[float, float]],
+                     limit: Optional[int] = None) -> Dict[int, Optional[float]]:
+        """Время в пути (сек) от точки до целей; None - цель недостижима
+
+        С limit время считается только до limit ближайших по дорогам целей,
+        у остальных тоже None. Результат кэшируется по геохешу точки
+        отправления: соседние запросы из того же квартала не пересчитывают
+        маршруты. Поиск идёт долго, поэтому из цикла событий метод вызывают
+        через asyncio.to_thread.
+        """
+        key = (geohash(lat, lon), tuple(sorted(destinations.items())), limit)
+        with self._cache_lock:
+            cached = self._origin_cache.get(key)
+            if cached is not None:
+                self._origin_cache.move_to_end(key)
+                return cached
+
+        result: Dict[int, Optional[float]] = dict.fromkeys(destinations)
+        source = self.snap(lat, lon)
+        if source is not None:
+            nodes = {}
+            for dest_id, (dest_lat, dest_lon) in destinations.items():
+                target = self.snap(dest_lat, dest_lon)
+                if target is not None:
+                    nodes[dest_id] = target
+            times = self.times_from(source, set(nodes.values()), limit)
+            for dest_id, target in nodes.items():
+                if target in times:
+                    dest_lat, dest_lon = destinations[dest_id]
+                    result[dest_id] = (
+                        times[target] + self._approach(lat, lon, source)
+                        + self._approach(dest_lat, dest_lon, target)
+                    )
+
+        with self._cache_lock:
+            self._origin_cache[key] = result
+            while len(self._origin_cache) > ORIGIN_CACHE_SIZE:
+                self._origin_cache.popitem(last=False)
+        return result
@@ -0,0 +1,54 @@
+"""
+VoltStation - встроенный список станций для карты на сайте
+Карта берёт станции из API бота, а если оно недоступно - из stations.js.
+Файл собирается из данных города: python site_stations.py
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Optional, List
+
+from cities import CityCatalog, load_registry, load_prompt_template, public_station
+
+logger = logging.getLogger(__name__)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUT_PATH = os.path.join(os.path.dirname(BOT_DIR), "stations.js")
+# Живые данные в снимке сразу устаревают - их показывает только API
+LIVE_FIELDS = ("available",)
+
+
+def render(city_key: str) -> str:
+    """Текст stations.js для города в формате ответа /api/stations"""
+    registry = load_registry()
+    city = CityCatalog(registry, city_key, load_prompt_template()).get(city_key)
+    stations = []
+    for station in city.stations:
+        station = public_station(station)
+        for field in LIVE_FIELDS:
+            station.pop(field, None)
+        stations.append(station)
+    data = json.dumps({"city": city.key, "stations": stations}, ensure_ascii=False, indent=4)
+    return (
+        f"// Собрано из bot/data/cities/{registry[city_key]['stations']}: python bot/site_stations.py\n"
+        f"// Не редактируйте вручную - карта показывает этот список, если API бота недоступно\n"
+        f"window.FALLBACK_STATIONS = {data};\n"
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Встроенный список станций для сайта")
+    parser.add_argument("--city", default=os.getenv("DEFAULT_CITY", "nizhnevartovsk"))
+    parser.add_argument("--out", default=DEFAULT_OUT_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.out, "w", encoding="utf-8", newline="\r\n") as f:
+        f.write(render(args.city))
+    logger.info(f"✅ Список станций записан в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+VoltStation - файлы состояния бота
+Атомарная запись JSON: читатель видит либо старый файл, либо новый целиком
+"""
+
+import json
+import os
+from typing import Any
+
+
+def write_json_atomic(path: str, data: Any, **dump_kwargs):
+    """Записать JSON во временный файл рядом и подменить им исходный"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_kwargs)
+    os.replace(tmp_path, path)
@@ -0,0 +1,73 @@
+"""
+Общие настройки тестов: модули бота импортируются из bot/, а main - с тестовым
+токеном и временными файлами вместо рабочих
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+from typing import List
+
+import pytest
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BOT_DIR)
+
+_tmp_dir = tempfile.mkdtemp(prefix="voltstation-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("RESERVATIONS_DB", os.path.join(_tmp_dir, "reservations.sqlite3"))
+os.environ.setdefault("ANALYTICS_DIR", os.path.join(_tmp_dir, "analytics"))
+os.environ.setdefault("MEDIA_CACHE_PATH", os.path.join(_tmp_dir, "media_cache.json"))
+os.environ.setdefault("FAQ_PATH", os.path.join(_tmp_dir, "faq.json"))
+os.environ.setdefault("USER_CITIES_PATH", os.path.join(_tmp_dir, "user_cities.json"))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, PhotoSize
+
+
+class RecordingSession(BaseSession):
+    """Сессия без сети: запоминает вызовы API и отвечает правдоподобными результатами"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests: List[TelegramMethod] = []
+        self._message_id = 1000
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        self.requests.append(method)
+        if method.__returning__ is bool:
+            return True
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None) or 1
+        photo = None
+        if type(method).__name__ in ("SendPhoto", "EditMessageMedia"):
+            file_id = f"photo{self._message_id}"
+            photo = [PhotoSize(file_id=file_id, file_unique_id=file_id, width=650, height=450)]
+        return Message(
+            message_id=getattr(method, "message_id", None) or self._message_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None),
+            photo=photo
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def names(self) -> List[str]:
+        return [type(m).__name__ for m in self.requests]
+
+
+@pytest.fixture
+def bot_main():
+    """Модуль main с ботом, который пишет вызовы API в RecordingSession"""
+    import main
+    main.bot.session = RecordingSession()
+    main.render_cache.clear()
+    return main
@@ -0,0 +1,49 @@
+"""Подписки на освобождение слотов"""
+
+import time
+
+from alerts import AlertIndex
+
+LAT, LON = 60.94, 76.57
+
+
+def test_match_by_radius():
+    index = AlertIndex(ttl=60, max_radius_km=5, max_subscriptions=100)
+    index.subscribe(1, 1, LAT, LON, 1)
+    index.subscribe(2, 2, LAT + 0.03, LON, 1)     # ~3.3 км севернее
+    assert [user_id for user_id, _ in index.match(LAT + 0.001, LON)] == [1]
+
+
+def test_overflow_evicts_earliest_expiry():
+    index = AlertIndex(ttl=60, max_radius_km=5, max_subscriptions=3)
+    for user_id in (1, 2, 3):
+        index.subscribe(user_id, user_id, LAT, LON, 1)
+    # Повторная подписка продлевает срок: первой истекает подписка 2
+    index.subscribe(1, 1, LAT, LON, 1)
+    index.subscribe(4, 4, LAT, LON, 1)
+    assert sorted(index.subscriptions) == [1, 3, 4]
+
+
+def test_purge_expired_skips_replaced_entries(monkeypatch):
+    index = AlertIndex(ttl=60, max_radius_km=5, max_subscriptions=100)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    index.subscribe(1, 1, LAT, LON, 1)
+    index.subscribe(2, 2, LAT, LON, 1)
+    monkeypatch.setattr(time, "time", lambda: now + 30)
+    index.subscribe(1, 1, LAT, LON, 1)       # продлена до now + 90
+    index.unsubscribe(2)
+
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert index.purge_expired() == 0
+    assert sorted(index.subscriptions) == [1]
+    monkeypatch.setattr(time, "time", lambda: now + 91)
+    assert index.purge_expired() == 1
+    assert len(index) == 0 and not index.cells
+
+
+def test_heap_stays_bounded_under_resubscribes():
+    index = AlertIndex(ttl=60, max_radius_km=5, max_subscriptions=100)
+    for _ in range(1000):
+        index.subscribe(1, 1, LAT, LON, 1)
+    assert len(index._expiry) <= 2 * len(index) + 64
@@ -0,0 +1,79 @@
+"""Каталог городов и выбор города пользователем"""
+
+import asyncio
+import os
+
+from cities import City, UserCities
+
+META = {
+    "name": "Тестовск",
+    "center": [60.0, 70.0],
+    "radius_km": 10,
+    "prices": {"scooter": 100, "bike": 150, "subscription": 500}
+}
+
+
+def test_city_without_stations_is_still_used(bot_main):
+    # Пустой город - falsy по len(), но это всё равно выбранный город
+    city = City("empty", META, [], "{city_in} {scooter} {bike} {subscription} {city_of}")
+    assert len(city) == 0
+
+    async def run():
+        bot_main.gigachat._token = "token"
+        bot_main.gigachat._expires_at = float("inf")
+        seen = {}
+
+        async def chat(token, messages, **kwargs):
+            seen["system"] = messages[0]["content"]
+            return {"choices": [{"message": {"content": "ok"}}]}
+
+        bot_main.gigachat.chat = chat
+        try:
+            await bot_main.ask_gigachat("вопрос", city=city)
+        finally:
+            del bot_main.gigachat.chat
+            bot_main.gigachat._token = None
+        return seen["system"]
+
+    assert asyncio.run(run()) == city.system_prompt
+
+
+def test_user_cities_survive_restart_and_stay_bounded(tmp_path):
+    path = str(tmp_path / "user_cities.json")
+
+    async def run():
+        choices = UserCities(path, max_users=2)
+        choices.start(interval=3600)
+        choices.set(1, "a")
+        choices.set(2, "b")
+        choices.set(3, "c")
+        # Выбор не пишет файл сам, сохранение - в фоне и при остановке
+        assert not os.path.exists(path)
+        await choices.stop()
+
+    asyncio.run(run())
+    restored = UserCities(path, max_users=2)
+    assert len(restored) == 2
+    assert restored.get(1) is None
+    assert (restored.get(2), restored.get(3)) == ("b", "c")
+
+
+def test_user_cities_flush_in_background(tmp_path):
+    path = str(tmp_path / "user_cities.json")
+
+    async def run():
+        choices = UserCities(path)
+        choices.start(interval=0.01)
+        choices.set(1, "a")
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            await asyncio.sleep(0.01)
+        # Без изменений файл больше не переписывается
+        mtime = os.stat(path).st_mtime_ns
+        await asyncio.sleep(0.05)
+        assert os.stat(path).st_mtime_ns == mtime
+        await choices.stop()
+
+    asyncio.run(run())
+    assert UserCities(path).get(1) == "a"
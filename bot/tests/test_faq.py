@@ -0,0 +1,78 @@
+"""Сборка готовых ответов через поддельный GigaChat и поиск по ним"""
+
+import asyncio
+import json
+import threading
+
+import pytest
+from aiohttp import web
+
+import faq
+from cities import CityCatalog, load_registry, load_prompt_template
+
+CITY = "nizhnevartovsk"
+
+
+@pytest.fixture
+def fake_gigachat(monkeypatch):
+    """OAuth и чат GigaChat на локальном порту в отдельном потоке"""
+    requests = []
+
+    async def oauth(request):
+        return web.json_response({"access_token": "test-token"})
+
+    async def chat(request):
+        assert request.headers["Authorization"] == "Bearer test-token"
+        data = await request.json()
+        requests.append(data["messages"])
+        question = data["messages"][-1]["content"]
+        return web.json_response({"choices": [{"message": {"content": f"Ответ: {question}"}}]})
+
+    app = web.Application()
+    app.router.add_post("/oauth", oauth)
+    app.router.add_post("/chat", chat)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("GIGACHAT_CLIENT_ID", "client")
+    monkeypatch.setenv("GIGACHAT_CLIENT_SECRET", "secret")
+    monkeypatch.setenv("GIGACHAT_AUTH_URL", f"http://127.0.0.1:{port}/oauth")
+    monkeypatch.setenv("GIGACHAT_API_URL", f"http://127.0.0.1:{port}/chat")
+    yield requests
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_build_writes_answers_matching_bot_prompt(fake_gigachat, tmp_path):
+    questions = tmp_path / "questions.txt"
+    questions.write_text(
+        "# комментарий\n"
+        "Сколько стоит зарядка электросамоката? | Цена зарядки самоката\n"
+        "Как связаться с оператором? | Телефон поддержки\n",
+        encoding="utf-8"
+    )
+    store_path = tmp_path / "faq.json"
+
+    faq.main(["build", "--questions", str(questions), "--out", str(store_path), "--city", CITY])
+
+    city = CityCatalog(load_registry(), CITY, load_prompt_template()).get(CITY)
+    entries = json.loads(store_path.read_text(encoding="utf-8"))["entries"]
+    assert len(entries) == 2 == len(fake_gigachat)
+    assert {e["prompt"] for e in entries} == {faq.prompt_fingerprint(city.system_prompt)}
+    # Вопросы задаются с тем же системным промптом, что и в боте
+    assert all(messages[0]["content"] == city.system_prompt for messages in fake_gigachat)
+
+    store = faq.FaqStore.load(str(store_path), min_similarity=0.75)
+    found = store.answer("цена зарядки самоката", CITY, city.system_prompt)
+    assert found and found[1] == "Ответ: Сколько стоит зарядка электросамоката?"
+    assert store.answer("цена зарядки самоката", CITY, city.system_prompt + " изменён") is None
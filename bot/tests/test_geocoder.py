@@ -0,0 +1,54 @@
+"""Офлайн-геокодер: опечатки, интерполяция домов и отсев вопросов"""
+
+import pytest
+
+from geocoder import Geocoder
+
+
+@pytest.fixture(scope="module")
+def geocoder():
+    return Geocoder.from_csv()
+
+
+@pytest.mark.parametrize("text, typos", [
+    ("ул. Ленина 15", 0),
+    ("улица ленин 15", 0),      # недописанное название с номером дома
+    ("Ленена 15", 1),
+    ("ул Ленинна, д. 15", 1)
+])
+def test_typos_are_tolerated(geocoder, text, typos):
+    address = geocoder.geocode(text)
+    assert address["street"] == "Ленина" and address["house"] == 15
+    assert address["typos"] == typos
+
+
+def test_house_is_interpolated_within_segment(geocoder):
+    # Мира, 51-103: дом 77 ровно посередине участка
+    address = geocoder.geocode("пр Мира 77")
+    assert address["lat"] == pytest.approx((60.9500 + 60.9495) / 2)
+    assert address["lon"] == pytest.approx((76.6060 + 76.6400) / 2)
+
+    # Номер за пределами справочника прижимается к концу ближайшего участка
+    address = geocoder.geocode("Мира 500")
+    assert (address["lat"], address["lon"]) == pytest.approx((60.9495, 76.6400))
+
+
+@pytest.mark.parametrize("text", ["привет", "сколько стоит зарядка"])
+def test_plain_questions_are_not_addresses(geocoder, text):
+    assert geocoder.geocode(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "а" * 65,
+    "подскажите пожалуйста где можно зарядить самокат ночью",
+    "Ленина 15 " * 400
+], ids=["long-word", "many-words", "huge-message"])
+def test_long_text_skips_street_search(geocoder, monkeypatch, text):
+    def search(*args, **kwargs):
+        raise AssertionError("длинный текст не должен доходить до поиска улиц")
+
+    monkeypatch.setattr(geocoder, "search", search)
+    misses = geocoder._lookup.cache_info().misses
+    assert geocoder.geocode(text) is None
+    # Текст сообщения не попадает и в кэш адресов
+    assert geocoder._lookup.cache_info().misses == misses
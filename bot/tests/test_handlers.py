@@ -0,0 +1,159 @@
+"""Обработчики бота целиком: обновление проходит через диспетчер до вызовов API"""
+
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+USER = User(id=42, is_bot=False, first_name="Тест")
+CHAT = Chat(id=42, type="private")
+
+
+def text_update(update_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(message_id=update_id, date=datetime.now(), chat=CHAT, from_user=USER, text=text)
+    )
+
+
+def callback_update(update_id: int, data: str, message_id: int = 7) -> Update:
+    message = Message(message_id=message_id, date=datetime.now(), chat=CHAT, text="⚡ VoltStation")
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=f"cb{update_id}", from_user=USER, chat_instance="ci", message=message, data=data
+        )
+    )
+
+
+@pytest.mark.parametrize("data", ["prices", "schedule", "find_station", "back_to_main"])
+def test_callback_edits_message_and_answers(bot_main, data):
+    async def run():
+        await bot_main.dp.feed_update(bot_main.bot, callback_update(1, data, message_id=hash(data) % 10000))
+
+    asyncio.run(run())
+    names = bot_main.bot.session.names()
+    assert names.count("EditMessageText") == 1
+    assert names.count("AnswerCallbackQuery") == 1
+
+
+def test_callback_sets_state(bot_main):
+    async def run():
+        await bot_main.dp.feed_update(bot_main.bot, callback_update(2, "find_station", message_id=501))
+        state = bot_main.dp.fsm.get_context(bot_main.bot, chat_id=CHAT.id, user_id=USER.id)
+        return await state.get_state()
+
+    assert asyncio.run(run()) == bot_main.BotStates.waiting_location.state
+
+
+def test_reply_plan_runs_side_actions_after_message_error(bot_main):
+    done = []
+
+    async def fail():
+        raise RuntimeError("send failed")
+
+    async def side():
+        done.append("side")
+
+    async def never():
+        done.append("never")
+
+    plan = bot_main.ReplyPlan().message(fail()).message(never()).side(side())
+    with pytest.raises(RuntimeError):
+        asyncio.run(plan.run())
+    assert done == ["side"]
+
+
+@pytest.fixture
+def faq_main(bot_main, monkeypatch):
+    """Хранилище с одним готовым ответом для города пользователя"""
+    from faq import FaqStore, prompt_fingerprint
+    city = bot_main.get_user_city(USER.id)
+    entry = {
+        "city": city.key,
+        "prompt": prompt_fingerprint(city.system_prompt),
+        "question": "Как найти ближайшую станцию?",
+        "variants": ["Где ближайшая станция"],
+        "answer": "Нажмите «Найти станцию» и отправьте геопозицию"
+    }
+    monkeypatch.setattr(bot_main, "faq_store", FaqStore([entry], min_similarity=0.75))
+    return bot_main
+
+
+def test_faq_answers_station_keyword_question(faq_main):
+    asyncio.run(faq_main.dp.feed_update(faq_main.bot, text_update(10, "Как найти ближайшую станцию?")))
+
+    sent = [m for m in faq_main.bot.session.requests if type(m).__name__ == "SendMessage"]
+    assert [m.text for m in sent] == ["Нажмите «Найти станцию» и отправьте геопозицию"]
+
+
+@pytest.mark.parametrize("text, with_location", [
+    ("Где ближайшая свободная станция?", True),
+    ("Все слоты заняты, что делать?", True),
+    ("Есть свободные слоты?", False),
+])
+def test_live_questions_skip_faq(faq_main, monkeypatch, text, with_location):
+    questions = []
+
+    async def ask_gigachat(question, context=None, user_id=None, city=None):
+        questions.append((question, context))
+        return "ответ ИИ"
+
+    monkeypatch.setattr(faq_main, "ask_gigachat", ask_gigachat)
+    if with_location:
+        faq_main.remember_location(USER.id, 60.94, 76.57)
+    try:
+        asyncio.run(faq_main.dp.feed_update(faq_main.bot, text_update(12, text)))
+    finally:
+        faq_main.user_locations.clear()
+
+    # Вопрос ушёл в ИИ вместе с таблицей станций и свободных слотов
+    assert len(questions) == 1 and "свободно" in questions[0][1]
+    sent = [m for m in faq_main.bot.session.requests if type(m).__name__ == "SendMessage"]
+    assert [m.text for m in sent] == ["ответ ИИ"]
+
+
+def test_station_view_uses_viewer_location(bot_main):
+    station = bot_main.catalog.station(1)
+    # Поиск другого пользователя не должен оставлять в каталоге своё расстояние
+    asyncio.run(bot_main.find_nearest_stations(station["lat"] + 0.1, station["lon"]))
+    assert "distance" not in station
+
+    asyncio.run(bot_main.dp.feed_update(bot_main.bot, callback_update(20, "station_1", message_id=601)))
+    bot_main.remember_location(USER.id, station["lat"], station["lon"])
+    asyncio.run(bot_main.dp.feed_update(bot_main.bot, callback_update(21, "station_1", message_id=602)))
+    bot_main.user_locations.clear()
+
+    views = [row for row in bot_main.event_log._pending if row[1] == "station_view"][-2:]
+    # Поля строки: ts, event, user_id, chat_id, city, station_id, lat, lon, duration_ms, data
+    assert [json.loads(row[9])["distance_km"] for row in views] == [None, 0.0]
+
+
+def test_station_card_is_edited_in_place(bot_main, monkeypatch):
+    # Повторные нажатия проверяем без окна защиты от двойного нажатия
+    monkeypatch.setattr(bot_main.update_gate, "debounce", 0)
+
+    async def run():
+        for update_id, data in enumerate(["station_1", "station_1", "station_2"], start=30):
+            await bot_main.dp.feed_update(bot_main.bot, callback_update(update_id, data, message_id=701))
+
+    asyncio.run(run())
+    cards = [m for m in bot_main.bot.session.requests if type(m).__name__ in ("SendPhoto", "EditMessageMedia")]
+    # Первое нажатие - новая карточка, повтор - ничего, другая станция - правка той же карточки
+    assert [type(m).__name__ for m in cards] == ["SendPhoto", "EditMessageMedia"]
+    assert cards[1].message_id == bot_main.station_cards[(CHAT.id, 701)]
+    assert "SendMessage" not in bot_main.bot.session.names()
+
+
+def test_station_card_error_is_not_sent_twice(bot_main, monkeypatch):
+    async def broken_send_card(*args, **kwargs):
+        raise RuntimeError("не ошибка картинки")
+
+    monkeypatch.setattr(bot_main.station_media, "send_card", broken_send_card)
+    # Ошибка не связана с картинкой - она уходит в диспетчер, а не во второе сообщение текстом
+    with pytest.raises(RuntimeError):
+        asyncio.run(bot_main.dp.feed_update(bot_main.bot, callback_update(40, "station_3", message_id=801)))
+    names = bot_main.bot.session.names()
+    assert "SendMessage" not in names and "EditMessageText" not in names
@@ -0,0 +1,96 @@
+"""Бронирование под нагрузкой: тысячи одновременных броней на несколько слотов"""
+
+import asyncio
+
+import pytest
+
+from reservations import ReservationEngine, ReservationError, TimerWheel
+
+SLOTS = 100
+REQUESTS = 5000
+
+
+def make_engine(tmp_path, hold_seconds: float, changes: dict) -> ReservationEngine:
+    engine = ReservationEngine(
+        str(tmp_path / "reservations.sqlite3"), hold_seconds,
+        on_change=lambda station_id, available: changes.__setitem__(station_id, available)
+    )
+    # Мелкий тик, чтобы брони истекали за доли секунды
+    engine.wheel = TimerWheel(tick=0.05)
+    return engine
+
+
+async def reserve_all(engine: ReservationEngine, first_user: int = 0):
+    results = await asyncio.gather(
+        *(engine.reserve(first_user + user_id, 1) for user_id in range(REQUESTS)),
+        return_exceptions=True
+    )
+    ok = [r for r in results if isinstance(r, dict)]
+    failed = [r for r in results if isinstance(r, ReservationError)]
+    assert len(ok) + len(failed) == REQUESTS
+    return ok
+
+
+def test_concurrent_reservations_never_oversell(tmp_path):
+    async def run():
+        changes = {}
+        engine = make_engine(tmp_path, hold_seconds=600, changes=changes)
+        await engine.open([{"id": 1, "available": SLOTS}])
+        try:
+            ok = await reserve_all(engine)
+            assert len(ok) == SLOTS
+            assert len({r["user_id"] for r in ok}) == SLOTS
+            assert changes[1] == 0
+
+            # Отменённая бронь возвращает слот, и его снова можно занять
+            assert await engine.cancel(ok[0]["user_id"], ok[0]["id"])
+            assert changes[1] == 1
+            again = await reserve_all(engine, first_user=REQUESTS)
+            assert len(again) == 1
+            assert changes[1] == 0
+        finally:
+            await engine.close()
+
+    asyncio.run(run())
+
+
+def test_expired_reservations_return_slots(tmp_path):
+    async def run():
+        changes = {}
+        engine = make_engine(tmp_path, hold_seconds=600, changes=changes)
+        await engine.open([{"id": 1, "available": SLOTS}])
+        try:
+            ok = await reserve_all(engine)
+            assert len(ok) == SLOTS
+            assert changes[1] == 0
+
+            # Срок брони наступает сразу после нагрузки, а не во время неё:
+            # иначе освободившиеся слоты заняли бы другие запросы
+            for reservation in ok:
+                engine.wheel.schedule(reservation["id"], 0.1)
+
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if changes[1] == SLOTS:
+                    break
+            assert changes[1] == SLOTS
+            assert len(engine.wheel) == 0
+            assert await engine.get_active(ok[0]["user_id"]) is None
+        finally:
+            await engine.close()
+
+    asyncio.run(run())
+
+
+def test_one_active_reservation_per_user(tmp_path):
+    async def run():
+        engine = make_engine(tmp_path, hold_seconds=600, changes={})
+        await engine.open([{"id": 1, "available": SLOTS}])
+        try:
+            await engine.reserve(7, 1)
+            with pytest.raises(ReservationError):
+                await engine.reserve(7, 1)
+        finally:
+            await engine.close()
+
+    asyncio.run(run())
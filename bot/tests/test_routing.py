@@ -0,0 +1,77 @@
+"""Время в пути по дорожному графу"""
+
+import random
+from array import array
+
+import pytest
+
+from routing import RoadRouter
+
+SIDE = 150          # 22 500 узлов, как у графа города
+STEP = 0.001
+
+
+def grid_router(side: int = SIDE) -> RoadRouter:
+    """Решётка улиц со случайными весами и отдельным островом из двух узлов"""
+    rng = random.Random(1)
+    lat, lon = array("d"), array("d")
+    for i in range(side):
+        for j in range(side):
+            lat.append(60.9 + i * STEP)
+            lon.append(76.5 + j * STEP)
+    edges = []
+    for i in range(side):
+        for j in range(side):
+            node = i * side + j
+            if j + 1 < side:
+                edges.append((node, node + 1, rng.uniform(5, 15)))
+            if i + 1 < side:
+                edges.append((node, node + side, rng.uniform(5, 15)))
+    island = len(lat)
+    for k in range(2):
+        lat.append(61.5)
+        lon.append(77.0 + k * STEP)
+    edges.append((island, island + 1, 10.0))
+
+    n = len(lat)
+    adjacency = [[] for _ in range(n)]
+    for a, b, w in edges:
+        adjacency[a].append((b, w))
+        adjacency[b].append((a, w))
+    offsets, targets, weights = array("l", [0]), array("l"), array("f")
+    for node_edges in adjacency:
+        for b, w in node_edges:
+            targets.append(b)
+            weights.append(w)
+        offsets.append(len(targets))
+    return RoadRouter(lat, lon, offsets, targets, weights)
+
+
+@pytest.fixture(scope="module")
+def router():
+    return grid_router()
+
+
+def test_times_from_matches_full_dijkstra(router):
+    rng = random.Random(2)
+    source = rng.randrange(SIDE * SIDE)
+    targets = {rng.randrange(SIDE * SIDE) for _ in range(20)}
+    full = router.dijkstra(source)
+
+    times = router.times_from(source, targets)
+    assert times.keys() == targets
+    for target, seconds in times.items():
+        assert seconds == pytest.approx(full[target], rel=1e-5)
+
+    nearest = router.times_from(source, targets, limit=3)
+    assert set(nearest) == set(sorted(targets, key=full.__getitem__)[:3])
+
+
+def test_unreachable_destination_is_none(router):
+    destinations = {
+        1: (router.lat[0], router.lon[0]),
+        2: (61.5, 77.0)      # остров без дорог в город
+    }
+    times = router.travel_times(router.lat[SIDE * SIDE // 2], router.lon[SIDE * SIDE // 2], destinations)
+    assert times[1] is not None
+    assert times[2] is None
@@ -0,0 +1,26 @@
+"""Встроенный список станций сайта собирается из данных города"""
+
+import json
+import os
+
+import site_stations
+from cities import DEFAULT_CITIES_DIR, load_registry
+
+
+def test_site_fallback_is_up_to_date():
+    with open(site_stations.DEFAULT_OUT_PATH, encoding="utf-8") as f:
+        assert f.read() == site_stations.render("nizhnevartovsk"), \
+            "stations.js устарел: пересоберите его командой python bot/site_stations.py"
+
+
+def test_site_fallback_has_every_station_without_live_counts(tmp_path):
+    out = tmp_path / "stations.js"
+    site_stations.main(["--city", "nizhnevartovsk", "--out", str(out)])
+    text = out.read_text(encoding="utf-8")
+    data = json.loads(text[text.index("{"):text.rindex("}") + 1])
+
+    registry = load_registry()
+    with open(os.path.join(DEFAULT_CITIES_DIR, registry["nizhnevartovsk"]["stations"]), encoding="utf-8") as f:
+        stations = json.load(f)
+    assert [s["id"] for s in data["stations"]] == [s["id"] for s in stations]
+    assert all("available" not in s for s in data["stations"])
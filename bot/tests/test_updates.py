@@ -0,0 +1,111 @@
+"""Очередь обновлений: повторные нажатия и порядок внутри чата"""
+
+import asyncio
+from datetime import datetime
+from typing import List
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Chat, Location, Message, Update, User
+
+from test_handlers import callback_update
+from updates import UpdateGate
+
+
+def chat_message(update_id: int, chat_id: int, text: str = None, location: Location = None) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"),
+            from_user=User(id=chat_id, is_bot=False, first_name="Тест"), text=text, location=location
+        )
+    )
+
+
+def location_update(update_id: int, chat_id: int) -> Update:
+    return chat_message(update_id, chat_id, location=Location(latitude=60.94, longitude=76.56))
+
+
+def gated_dispatcher(gate: UpdateGate, log: List[str], release: asyncio.Event) -> Dispatcher:
+    """Диспетчер, у которого текст ждёт release, а геопозиция пишется в log сразу"""
+    dp = Dispatcher()
+    dp.update.outer_middleware(gate)
+
+    @dp.message(F.text)
+    async def slow_text(message: Message):
+        log.append(f"text {message.chat.id}")
+        await release.wait()
+        log.append(f"text {message.chat.id} done")
+
+    @dp.message(F.location)
+    async def location(message: Message):
+        log.append(f"location {message.chat.id}")
+
+    return dp
+
+
+def test_repeated_taps_edit_once_and_answer_each(bot_main):
+    async def run():
+        await asyncio.gather(*(
+            bot_main.dp.feed_update(bot_main.bot, callback_update(900 + i, "prices", message_id=9001))
+            for i in range(3)
+        ))
+
+    asyncio.run(run())
+    names = bot_main.bot.session.names()
+    assert names.count("EditMessageText") == 1
+    assert names.count("AnswerCallbackQuery") == 3
+
+
+def test_slow_update_delays_only_its_own_chat():
+    async def run():
+        log: List[str] = []
+        release = asyncio.Event()
+        dp = gated_dispatcher(UpdateGate(), log, release)
+        bot = Bot("123456:test")
+
+        text_a = asyncio.create_task(dp.feed_update(bot, chat_message(1, 1, text="медленно")))
+        await asyncio.sleep(0)
+        location_a = asyncio.create_task(dp.feed_update(bot, location_update(2, 1)))
+        await asyncio.wait_for(dp.feed_update(bot, location_update(3, 2)), 1)
+        assert log == ["text 1", "location 2"]
+        assert not location_a.done()
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(text_a, location_a), 1)
+        assert log == ["text 1", "location 2", "text 1 done", "location 1"]
+
+    asyncio.run(run())
+
+
+def test_eviction_keeps_locks_in_use():
+    async def run():
+        log: List[str] = []
+        release = asyncio.Event()
+        # Каждый новый чат переполняет таблицу и запускает чистку
+        gate = UpdateGate(idle_ttl=0, max_chats=2)
+        dp = gated_dispatcher(gate, log, release)
+        bot = Bot("123456:test")
+
+        busy = asyncio.create_task(dp.feed_update(bot, chat_message(1, 1, text="медленно")))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(dp.feed_update(bot, location_update(2, 1)))
+        await asyncio.sleep(0)
+        queue = gate._chats[1]
+        assert queue.users == 2
+
+        for chat_id in range(2, 12):
+            await asyncio.wait_for(dp.feed_update(bot, location_update(100 + chat_id, chat_id)), 1)
+        assert gate._chats[1] is queue
+        assert len(gate._chats) <= 3
+
+        # Новое обновление чата 1 встаёт в ту же очередь, а не обходит её
+        late = asyncio.create_task(dp.feed_update(bot, location_update(200, 1)))
+        await asyncio.sleep(0)
+        assert queue.users == 3 and "location 1" not in log
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(busy, waiting, late), 1)
+        assert log[-3:] == ["text 1 done", "location 1", "location 1"]
+        assert queue.users == 0
+
+    asyncio.run(run())
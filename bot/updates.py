@@ -0,0 +1,145 @@
+"""
+VoltStation - порядок и дедупликация входящих обновлений
+Повторные нажатия одной кнопки отбрасываются, обновления одного чата обрабатываются по очереди
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Hashable, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+
+class ChatQueue:
+    """Замок чата и число обновлений, которые его держат или ждут"""
+    __slots__ = ("lock", "users", "last_used")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class UpdateGate(BaseMiddleware):
+    """Внешний middleware для всех обновлений
+
+    1. Одинаковые callback (тот же пользователь, сообщение и данные кнопки)
+       в пределах debounce секунд считаются двойным нажатием: на повтор сразу
+       отвечается пустым answer(), и в обработчики он не попадает.
+    2. Обновления одного чата ждут друг друга на замке чата, поэтому текст и
+       геопозиция обрабатываются в порядке получения. Разные чаты не ждут
+       друг друга. asyncio.Lock пропускает ожидающих по очереди прихода, а
+       задачи обновлений создаются в порядке их поступления.
+
+    Обе таблицы ограничены по размеру и чистятся по времени: отпечатки нажатий
+    живут debounce секунд, замки - пока ими пользуются и ещё idle_ttl секунд.
+    """
+
+    def __init__(self, debounce: float = 1.0, idle_ttl: float = 600,
+                 max_callbacks: int = 10000, max_chats: int = 10000):
+        self.debounce = debounce
+        self.idle_ttl = idle_ttl
+        self.max_callbacks = max_callbacks
+        self.max_chats = max_chats
+        self.debounced = 0
+        self._callbacks: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._chats: "OrderedDict[int, ChatQueue]" = OrderedDict()
+
+    def stats(self) -> Dict:
+        return {
+            "debounced_callbacks": self.debounced,
+            "tracked_callbacks": len(self._callbacks),
+            "chat_queues": len(self._chats)
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update) and event.callback_query and self._is_repeat(event):
+            self.debounced += 1
+            try:
+                await event.callback_query.answer()
+            except Exception as e:
+                logger.debug(f"Не удалось ответить на повторный callback: {e}")
+            return None
+
+        chat = data.get("event_chat")
+        if chat is None:
+            # Инлайн-запросы и прочее без чата - без очереди
+            return await handler(event, data)
+
+        queue = self._acquire_queue(chat.id)
+        try:
+            async with queue.lock:
+                return await handler(event, data)
+        finally:
+            queue.users -= 1
+            queue.last_used = time.monotonic()
+
+    # ---------- повторные нажатия ----------
+
+    def _is_repeat(self, update: Update) -> bool:
+        callback = update.callback_query
+        message = callback.message
+        key = (
+            callback.from_user.id,
+            message.chat.id if message else None,
+            message.message_id if message else callback.inline_message_id,
+            callback.data
+        )
+        now = time.monotonic()
+
+        # Записи идут в порядке времени - устаревшие снимаем с головы
+        while self._callbacks:
+            seen_at = next(iter(self._callbacks.values()))
+            if now - seen_at <= self.debounce and len(self._callbacks) < self.max_callbacks:
+                break
+            self._callbacks.popitem(last=False)
+
+        seen_at = self._callbacks.get(key)
+        if seen_at is not None and now - seen_at <= self.debounce:
+            return True
+        self._callbacks.pop(key, None)
+        self._callbacks[key] = now
+        return False
+
+    # ---------- очереди чатов ----------
+
+    def _acquire_queue(self, chat_id: int) -> ChatQueue:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            self._evict_idle()
+            queue = self._chats[chat_id] = ChatQueue()
+        else:
+            self._chats.move_to_end(chat_id)
+        queue.users += 1
+        return queue
+
+    def _evict_idle(self):
+        """Убрать замки, которыми давно никто не пользуется
+
+        Замок, который кто-то держит или ждёт, не удаляется никогда: иначе
+        следующее обновление чата получило бы новый замок и обошло очередь.
+        """
+        now = time.monotonic()
+        overflow = len(self._chats) >= self.max_chats
+        evict: List[int] = []
+        for chat_id, queue in self._chats.items():
+            if queue.users:
+                continue
+            if overflow or now - queue.last_used > self.idle_ttl:
+                evict.append(chat_id)
+                overflow = len(self._chats) - len(evict) >= self.max_chats
+            else:
+                # Дальше только более свежие замки
+                break
+        for chat_id in evict:
+            del self._chats[chat_id]
@@ -239,6 +239,37 @@ const throttledScroll = throttle(() => {
 
 window.addEventListener('scroll', throttledScroll);
 
+// Load stations from the bot API
+async function loadStations(url) {
+    // ETag/304 обрабатывает HTTP-кэш браузера
+    const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return toMapStations(await response.json());
+}
+
+// Станции из ответа API или встроенного списка stations.js (тот же формат,
+// но без числа свободных мест)
+function toMapStations(data) {
+    return data.stations.map((station) => ({
+        coords: [station.lat, station.lon],
+        name: station.name,
+        address: station.address,
+        status: station.status !== 'active'
+            ? `Откроется в ${station.opens || 'ближайшее время'}`
+            : station.available === undefined
+                ? 'Работает 24/7'
+                : `Работает 24/7 · свободно ${station.available}/${station.slots}`,
+        available: station.status === 'active'
+    }));
+}
+
+// Встроенный список нужен, чтобы карта не оставалась пустой без API бота
+function fallbackStations() {
+    return window.FALLBACK_STATIONS ? toMapStations(window.FALLBACK_STATIONS) : [];
+}
+
 // Initialize Yandex Map
 function initMap() {
     if (typeof ymaps === 'undefined') {
@@ -267,45 +298,6 @@ function initMap() {
         // Стиль карты - тёмная тема
         map.options.set('theme', 'dark');
 
-        // Точки станций в спальных районах Нижневартовска (2026)
-        const stations = [
-            {
-                coords: [60.9450, 76.5750],
-                name: 'Станция №1',
-                address: 'ул. Ленина, 15',
-                status: 'Работает 24/7',
-                available: true
-            },
-            {
-                coords: [60.9300, 76.5600],
-                name: 'Станция №2',
-                address: 'пр. Победы, 8',
-                status: 'Работает 24/7',
-                available: true
-            },
-            {
-                coords: [60.9500, 76.5800],
-                name: 'Станция №3',
-                address: 'ул. Мира, 25',
-                status: 'Работает 24/7',
-                available: true
-            },
-            {
-                coords: [60.9200, 76.5500],
-                name: 'Станция №4',
-                address: 'ул. Ханты-Мансийская, 12',
-                status: 'Откроется в Q2 2026',
-                available: false
-            },
-            {
-                coords: [60.9550, 76.5850],
-                name: 'Станция №5',
-                address: 'пр. Комсомольский, 30',
-                status: 'Откроется в Q2 2026',
-                available: false
-            }
-        ];
-
         // Создаём кастомные иконки для маркеров
         const createCustomIcon = (isAvailable = true) => {
             const strokeColor = isAvailable ? '#00FF88' : '#FFA500';
@@ -320,7 +312,7 @@ function initMap() {
             return 'data:image/svg+xml;base64,' + btoa(unescape(encodeURIComponent(svg)));
         };
 
-        stations.forEach((station) => {
+        const addStations = (stations) => stations.forEach((station) => {
             const statusColor = station.available ? '#00FF88' : '#FFA500';
             const statusIcon = station.available ? '✓' : '⏳';
             
@@ -344,13 +336,26 @@ function initMap() {
             map.geoObjects.add(placemark);
         });
 
-        // Устанавливаем границы карты, чтобы все точки были видны
-        if (stations.length > 0) {
-            map.setBounds(map.geoObjects.getBounds(), {
-                checkZoomRange: true,
-                duration: 500
-            });
-        }
+        // Станции берём из API бота (адрес - в data-stations-url, сайт и бот
+        // живут на разных хостах); если API недоступно - встроенный список
+        const stationsUrl = mapContainer.dataset.stationsUrl;
+        const stationsLoaded = stationsUrl
+            ? loadStations(stationsUrl).catch((error) => {
+                console.warn('Не удалось загрузить станции, показываем встроенный список:', error);
+                return fallbackStations();
+            })
+            : Promise.resolve(fallbackStations());
+
+        stationsLoaded.then((stations) => {
+            addStations(stations);
+            // Устанавливаем границы карты, чтобы все точки были видны
+            if (stations.length > 0) {
+                map.setBounds(map.geoObjects.getBounds(), {
+                    checkZoomRange: true,
+                    duration: 500
+                });
+            }
+        });
 
         // Применяем тёмную тему к элементам управления
         setTimeout(() => {
@@ -0,0 +1,78 @@
+// Собрано из bot/data/cities/nizhnevartovsk.json: python bot/site_stations.py
+// Не редактируйте вручную - карта показывает этот список, если API бота недоступно
+window.FALLBACK_STATIONS = {
+    "city": "nizhnevartovsk",
+    "stations": [
+        {
+            "id": 1,
+            "name": "Станция №1",
+            "address": "ул. Ленина, 15",
+            "lat": 60.945,
+            "lon": 76.575,
+            "status": "active",
+            "slots": 8,
+            "price_scooter": 150,
+            "price_bike": 200,
+            "rating": 4.8,
+            "features": [
+                "Крытая площадка",
+                "Видеонаблюдение",
+                "Освещение"
+            ]
+        },
+        {
+            "id": 2,
+            "name": "Станция №2",
+            "address": "пр. Победы, 8",
+            "lat": 60.93,
+            "lon": 76.56,
+            "status": "active",
+            "slots": 6,
+            "price_scooter": 150,
+            "price_bike": 200,
+            "rating": 4.9,
+            "features": [
+                "Крытая площадка",
+                "Видеонаблюдение"
+            ]
+        },
+        {
+            "id": 3,
+            "name": "Станция №3",
+            "address": "ул. Мира, 25",
+            "lat": 60.95,
+            "lon": 76.58,
+            "status": "active",
+            "slots": 10,
+            "price_scooter": 150,
+            "price_bike": 200,
+            "rating": 4.7,
+            "features": [
+                "Крытая площадка",
+                "Видеонаблюдение",
+                "Освещение",
+                "Wi-Fi"
+            ]
+        },
+        {
+            "id": 4,
+            "name": "Станция №4",
+            "address": "ул. Ханты-Мансийская, 12",
+            "lat": 60.92,
+            "lon": 76.55,
+            "status": "coming_soon",
+            "slots": 8,
+            "opens": "Q2 2026"
+        },
+        {
+            "id": 5,
+            "name": "Станция №5",
+            "address": "пр. Комсомольский, 30",
+            "lat": 60.955,
+            "lon": 76.585,
+            "status": "coming_soon",
+            "slots": 6,
+            "opens": "Q2 2026"
+        }
+    ]
+};